@@ -6,23 +6,63 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
+from app.database import RoutingSession, configure_engines, install_sqlite_pragmas
+from app.image_worker import ImageWorker
+from app.activity import ActivityTracker
+from app.user_cache import UserCache
+from app.uploads import UploadRequest
+from app.outbox import MailOutbox
+from app.metrics import Metrics
+from app.query_monitor import QueryMonitor
+from app.fragment_cache import FragmentCache
+from app.page_cache import PageCache
+from app.similarity import SimilarityIndex
+from app.storage import Storage
+from app.assets import AssetManifest
 from config import Config
 
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login = LoginManager()
 mail = Mail()
+image_worker = ImageWorker()
+activity = ActivityTracker()
+user_cache = UserCache()
+outbox = MailOutbox()
+metrics = Metrics()
+query_monitor = QueryMonitor()
+fragment_cache = FragmentCache()
+page_cache = PageCache()
+similarity_index = SimilarityIndex()
+storage = Storage()
+assets = AssetManifest()
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.request_class = UploadRequest
     app.config.from_object(config_class)
 
+    configure_engines(app)
     db.init_app(app)
+    with app.app_context():
+        install_sqlite_pragmas(app, db.engines)
     migrate.init_app(app, db)
     login.init_app(app)
     mail.init_app(app)
+    image_worker.init_app(app)
+    activity.init_app(app)
+    user_cache.init_app(app)
+    outbox.init_app(app)
+    metrics.init_app(app)
+    metrics.gauge(outbox.metrics)
+    query_monitor.init_app(app)
+    fragment_cache.init_app(app)
+    page_cache.init_app(app)
+    similarity_index.init_app(app)
+    storage.init_app(app)
+    assets.init_app(app)
 
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
@@ -30,6 +70,12 @@ def create_app(config_class=Config):
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
 
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+
     if not app.debug and not app.testing:
         if not os.path.exists('logs'):
             os.mkdir('logs')
@@ -47,4 +93,4 @@ def create_app(config_class=Config):
     return app
 
 
-from app import models
+from app import models, search
@@ -0,0 +1,83 @@
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class ActivityTracker:
+    # Write-behind buffer for User.last_seen: requests only record activity in
+    # memory, and pending timestamps are written in one batched UPDATE once
+    # the oldest of them reaches LAST_SEEN_FLUSH_INTERVAL seconds.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.freshness = timedelta(seconds=60)
+        self.flush_interval = timedelta(seconds=30)
+        self._pending: dict[int, datetime] = {}
+        self._oldest: datetime | None = None
+        self._lock = threading.Lock()
+        self._timer_pid: int | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.freshness = timedelta(seconds=app.config['LAST_SEEN_FRESHNESS'])
+        self.flush_interval = timedelta(seconds=app.config['LAST_SEEN_FLUSH_INTERVAL'])
+        app.extensions['activity'] = self
+        atexit.register(self.flush)
+
+    def touch(self, user_id: int, last_seen: datetime | None) -> None:
+        now = utcnow()
+        if last_seen is not None:
+            if last_seen.tzinfo is not None:
+                last_seen = last_seen.astimezone(timezone.utc).replace(tzinfo=None)
+            if now - last_seen < self.freshness:
+                return
+        with self._lock:
+            self._pending[user_id] = now
+            if self._oldest is None:
+                self._oldest = now
+            due = now - self._oldest >= self.flush_interval
+        if due:
+            self.flush()
+        else:
+            self._start_timer()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+        if not pending or self.app is None:
+            return
+        import sqlalchemy as sa
+        from app import db
+        from app.models import User
+        with self.app.app_context():
+            try:
+                db.session.execute(
+                    sa.update(User)
+                    .where(User.id.in_(pending))
+                    .values(last_seen=sa.case(pending, value=User.id))
+                    .execution_options(synchronize_session=False))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.app.logger.exception('Could not record user activity')
+
+    def _start_timer(self) -> None:
+        if self._timer_pid == os.getpid():
+            return
+        self._timer_pid = os.getpid()
+
+        def run() -> None:
+            while True:
+                time.sleep(self.flush_interval.total_seconds() or 1)
+                self.flush()
+
+        threading.Thread(target=run, name='last-seen-flush', daemon=True).start()
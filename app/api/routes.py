@@ -0,0 +1,146 @@
+import gzip
+import hashlib
+from typing import Any, Callable
+from flask import jsonify, request, current_app, abort
+from werkzeug.exceptions import HTTPException
+import sqlalchemy as sa
+from app import db
+from app.api import bp
+from app.models import FoundItem, FoundItemStatus
+from app.pagination import paginate_found_items, found_item_changes, encode_since, \
+    decode_since
+from app.main.routes import found_item_image_url
+from app.database import use_replica
+from app.query_monitor import query_budget
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+FIELDS: dict[str, Callable[[FoundItem], Any]] = {
+    'id': lambda i: i.id,
+    'title': lambda i: i.title,
+    'description': lambda i: i.description,
+    'date_found': lambda i: _isoformat(i.date_found),
+    'location_found': lambda i: i.location_found,
+    'status': lambda i: i.status.value,
+    'updated': lambda i: _isoformat(i.updated),
+    'image_url': lambda i: found_item_image_url(i) if i.image_filename else None,
+    'thumbnail_url': lambda i: found_item_image_url(i, 'small')
+    if i.image_filename else None,
+}
+
+
+def requested_fields() -> list[str]:
+    # sparse fieldsets: ?fields=title,thumbnail_url (id is always included)
+    fields = request.args.get('fields')
+    if not fields:
+        return list(FIELDS)
+    names = ['id'] + [name for name in fields.split(',') if name and name != 'id']
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown:
+        abort(400, f'Unknown fields: {", ".join(unknown)}')
+    return names
+
+
+def to_dict(found_item: FoundItem, fields: list[str]) -> dict[str, Any]:
+    return {name: FIELDS[name](found_item) for name in fields}
+
+
+def limit_arg(name: str, default: int) -> int:
+    value = request.args.get(name, default, type=int)
+    return max(1, min(value, current_app.config['API_MAX_PER_PAGE']))
+
+
+@bp.route('/found_items', methods=['GET'])
+@query_budget(1)
+@use_replica
+def list_found_items():
+    fields = requested_fields()
+    page = paginate_found_items(request.args.get('cursor'),
+                                per_page=limit_arg('per_page',
+                                                   current_app.config['API_ITEMS_PER_PAGE']),
+                                statuses=(FoundItemStatus.PUBLISHED,))
+    return jsonify(items=[to_dict(item, fields) for item in page],
+                   next_cursor=page.next_cursor, prev_cursor=page.prev_cursor)
+
+
+@bp.route('/found_items/batch', methods=['GET'])
+@query_budget(1)
+@use_replica
+def batch_found_items():
+    fields = requested_fields()
+    try:
+        ids = list(dict.fromkeys(int(id) for id in request.args.get('ids', '').split(',')
+                                 if id))
+    except ValueError:
+        abort(400, 'ids must be a comma separated list of integers')
+    if len(ids) > current_app.config['API_MAX_PER_PAGE']:
+        abort(400, f'At most {current_app.config["API_MAX_PER_PAGE"]} ids per request')
+    found = {item.id: item for item in db.session.scalars(
+        sa.select(FoundItem).where(FoundItem.id.in_(ids),
+                                   FoundItem.status == FoundItemStatus.PUBLISHED))} \
+        if ids else {}
+    return jsonify(items=[to_dict(found[id], fields) for id in ids if id in found],
+                   missing=[id for id in ids if id not in found])
+
+
+@bp.route('/found_items/<int:id>', methods=['GET'])
+@query_budget(1)
+@use_replica
+def get_found_item(id):
+    fields = requested_fields()
+    found_item = db.session.get(FoundItem, id)
+    if found_item is None or found_item.status != FoundItemStatus.PUBLISHED:
+        abort(404)
+    return jsonify(to_dict(found_item, fields))
+
+
+@bp.route('/changes', methods=['GET'])
+@query_budget(1)
+@use_replica
+def changes():
+    # Only items that have been published appear here. Those that stopped
+    # being published are reported by id in `removed`; pass `since` from the
+    # previous response to continue from there.
+    fields = requested_fields()
+    since = request.args.get('since')
+    try:
+        key = decode_since(since) if since else None
+    except ValueError:
+        abort(400, 'Invalid since token')
+    items, has_more = found_item_changes(
+        key, limit_arg('limit', current_app.config['API_ITEMS_PER_PAGE']),
+        settle=current_app.config['API_CHANGES_SETTLE'])
+    return jsonify(
+        items=[to_dict(item, fields) for item in items
+               if item.status == FoundItemStatus.PUBLISHED],
+        removed=[item.id for item in items if item.status != FoundItemStatus.PUBLISHED],
+        since=encode_since(items[-1]) if items else since,
+        has_more=has_more)
+
+
+@bp.errorhandler(HTTPException)
+def api_error(error):
+    response = jsonify(error=error.name, message=error.description)
+    response.status_code = error.code
+    return response
+
+
+@bp.after_request
+def conditional_response(response):
+    # the ETag describes the JSON document, so it stays weak and shared by
+    # the plain and gzip encodings; unchanged polls get an empty 304
+    if response.status_code != 200 or response.direct_passthrough:
+        return response
+    data = response.get_data()
+    response.set_etag(hashlib.sha1(data).hexdigest(), weak=True)
+    response.cache_control.no_cache = True
+    response.vary.add('Accept-Encoding')
+    response.make_conditional(request)
+    if response.status_code == 200 and len(data) >= current_app.config['API_GZIP_MIN_SIZE'] \
+            and 'gzip' in request.accept_encodings:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,150 @@
+import mimetypes
+import shutil
+import zipfile
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+import sqlalchemy as sa
+from flask import current_app
+from app import db, similarity_index
+from app.models import ArchivedFoundItem, FoundItem, FoundItemStatus, ImageBlob, \
+    LostItemMatch
+from app.main.image_files import blob_dir, image_dir, image_path, image_version, \
+    item_image_dir, replace_atomically, safe_rmtree, touch
+
+# Closed found items past the retention window are moved to
+# archived_found_item. Their originals are packed into one zip per month
+# found, which keeps them individually readable, and only the small
+# thumbnail stays in the static folder. The blobs they referenced are
+# released and removed by `flask images gc` once nothing else uses them.
+ARCHIVE_THUMBNAIL = 'small'
+
+
+def archive_root() -> Path:
+    return Path(current_app.instance_path, current_app.config['ARCHIVE_FOLDER'])
+
+
+def archived_thumbnail_path(id: int) -> Path:
+    assert current_app.static_folder is not None
+    return Path(current_app.static_folder, current_app.config['IMAGE_FOLDER'],
+                'archived', str(id), 'thumb.jpg')
+
+
+def archive_member(found_item: FoundItem) -> str:
+    ext = Path(found_item.image_filename or '').suffix
+    if found_item.image_sha256:
+        return f'{found_item.image_sha256}{ext}'
+    return f'item-{found_item.id}{ext}'
+
+
+def archive_name(found_item: FoundItem) -> str:
+    found = found_item.date_found or found_item.updated or datetime.now()
+    return f'{found:%Y-%m}.zip'
+
+
+def append_to_archive(path: Path, members: dict[str, Path]) -> None:
+    # Compressed archives cannot be appended to in place safely, so the
+    # month is rewritten into a copy that replaces it. Members that are
+    # already there are kept, so an interrupted run can simply be repeated.
+    def write(tmp: Path) -> None:
+        if path.exists():
+            shutil.copyfile(path, tmp)
+        with zipfile.ZipFile(tmp, 'a', compression=zipfile.ZIP_DEFLATED) as archive:
+            present = set(archive.namelist())
+            for name, source in members.items():
+                if name not in present:
+                    archive.write(source, name)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    replace_atomically(path, write)
+
+
+def archive_found_items(before: datetime, batch_size: int = 100,
+                        progress: Callable[[int], None] | None = None) -> int:
+    """Archive found items closed before `before` and return how many were
+    archived."""
+    # SQLite hands out max(id) + 1, so the newest item is never archived
+    # or its id could be given to the next found item
+    newest = db.session.scalar(sa.select(sa.func.max(FoundItem.id)))
+    done = 0
+    if newest is None:
+        return done
+    while True:
+        found_items = db.session.scalars(
+            sa.select(FoundItem)
+            .where(FoundItem.status == FoundItemStatus.CLOSED,
+                   FoundItem.updated < before, FoundItem.id < newest,
+                   sa.not_(FoundItem.image_processing))
+            .order_by(FoundItem.id)
+            .limit(batch_size)).all()
+        if not found_items:
+            return done
+        archive_batch(found_items)
+        done += len(found_items)
+        if progress:
+            progress(done)
+
+
+def archive_batch(found_items: list[FoundItem]) -> None:
+    # files are written before the rows move, so a failure leaves at worst
+    # some unreferenced archive members and thumbnails behind
+    months: dict[str, dict[str, Path]] = defaultdict(dict)
+    rows = []
+    for found_item in found_items:
+        row = {'id': found_item.id, 'title': found_item.title,
+               'description': found_item.description,
+               'date_found': found_item.date_found,
+               'location_found': found_item.location_found,
+               'user_id': found_item.user_id, 'status': found_item.status,
+               'image_filename': None, 'image_version': None, 'image_archive': None}
+        original = image_path(found_item) if found_item.image_filename else None
+        if original is not None and original.is_file():
+            row.update(image_filename=archive_member(found_item),
+                       image_version=image_version(found_item),
+                       image_archive=archive_name(found_item))
+            months[row['image_archive']][row['image_filename']] = original
+            thumbnail = Path(image_dir(found_item), f'thumb_{ARCHIVE_THUMBNAIL}', 'thumb.jpg')
+            if thumbnail.is_file():
+                target = archived_thumbnail_path(found_item.id)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                replace_atomically(target, lambda tmp: shutil.copyfile(thumbnail, tmp))
+        rows.append(row)
+    for name, members in months.items():
+        append_to_archive(Path(archive_root(), name), members)
+
+    ids = [found_item.id for found_item in found_items]
+    legacy = [found_item.id for found_item in found_items
+              if found_item.image_filename and not found_item.image_sha256]
+    db.session.execute(sa.insert(ArchivedFoundItem), rows)
+    blobs = Counter(found_item.image_sha256 for found_item in found_items
+                    if found_item.image_sha256)
+    for sha256, count in blobs.items():
+        db.session.execute(
+            sa.update(ImageBlob)
+            .where(ImageBlob.sha256 == sha256)
+            .values(ref_count=ImageBlob.ref_count - count))
+    db.session.execute(sa.delete(LostItemMatch).where(LostItemMatch.found_item_id.in_(ids)))
+    db.session.execute(sa.delete(FoundItem).where(FoundItem.id.in_(ids))
+                       .execution_options(synchronize_session=False))
+    db.session.commit()
+    db.session.expunge_all()
+    similarity_index.discard(ids)
+    # the grace period of images that are no longer used starts now
+    for sha256 in blobs:
+        touch(blob_dir(sha256))
+    for id in legacy:
+        safe_rmtree(item_image_dir(id))
+
+
+def read_archived_image(archived_item: ArchivedFoundItem) -> tuple[bytes, str] | None:
+    # returns the original image and its mimetype
+    if not archived_item.image_archive or not archived_item.image_filename:
+        return None
+    try:
+        with zipfile.ZipFile(Path(archive_root(), archived_item.image_archive)) as archive:
+            data = archive.read(archived_item.image_filename)
+    except (OSError, KeyError, zipfile.BadZipFile):
+        return None
+    mimetype = mimetypes.guess_type(archived_item.image_filename)[0]
+    return data, mimetype or 'application/octet-stream'
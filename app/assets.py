@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+from pathlib import Path, PurePosixPath
+from flask import Flask, current_app, url_for
+from werkzeug.security import safe_join
+
+# `flask assets build` copies every file under RESOURCES_FOLDER into
+# ASSETS_FOLDER under a name that includes a hash of its content, next to
+# precompressed .gz (and .br, when brotli is installed) siblings, and records
+# them in a manifest. Templates link to assets through asset_url(), so a
+# changed file gets a new URL and the old one can be cached forever.
+MANIFEST = 'manifest.json'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE_TYPES = ('application/javascript', 'application/json', 'application/xml',
+                      'image/svg+xml', 'text/javascript')
+
+
+def fingerprint(name: str, digest: str) -> str:
+    path = PurePosixPath(name)
+    return str(path.with_name(f'{path.stem}.{digest}{path.suffix}'))
+
+
+def compressible(name: str) -> bool:
+    mimetype = mimetypes.guess_type(name)[0] or ''
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+def write_file(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}')
+    try:
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def build_assets(source: Path, target: Path) -> dict[str, dict]:
+    """Fingerprint and precompress the files under `source` into `target`
+    and return the manifest. Files of earlier builds are left in place for
+    pages that still reference them."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+    manifest = {}
+    for path in sorted(source.rglob('*')):
+        name = path.relative_to(source).as_posix()
+        if not path.is_file() or any(part.startswith('.') for part in name.split('/')):
+            continue
+        data = path.read_bytes()
+        built = fingerprint(name, hashlib.sha256(data).hexdigest()[:12])
+        output = Path(target, built)
+        if not output.is_file():
+            write_file(output, data)
+        encodings = []
+        if compressible(name):
+            compressed = {'gzip': lambda: gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                compressed['br'] = lambda: brotli.compress(data, quality=11)
+            for encoding, suffix in ENCODINGS:
+                if encoding not in compressed:
+                    continue
+                variant = output.with_name(output.name + suffix)
+                if not variant.is_file():
+                    packed = compressed[encoding]()
+                    # not worth serving if it barely saves anything
+                    if len(packed) >= len(data) * 0.9:
+                        continue
+                    write_file(variant, packed)
+                encodings.append(encoding)
+        manifest[name] = {'path': built, 'encodings': encodings}
+    write_file(Path(target, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+class AssetManifest:
+    # The manifest is reread when the build replaces it, so a deploy that
+    # only rebuilds assets does not need a restart.
+    def __init__(self, app: Flask | None = None) -> None:
+        self._assets: dict[str, dict] = {}
+        self._mtime: float | None = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.extensions['assets'] = self
+        app.add_template_global(self.asset_url)
+
+    def folder(self) -> Path:
+        assert current_app.static_folder is not None
+        return Path(current_app.static_folder, current_app.config['ASSETS_FOLDER'])
+
+    def load(self) -> None:
+        path = Path(self.folder(), MANIFEST)
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            try:
+                assets = json.loads(path.read_text()) if mtime is not None else {}
+            except (OSError, ValueError):
+                current_app.logger.error(f'Unreadable asset manifest {path}')
+                assets = {}
+            self._assets = assets
+            self._mtime = mtime
+
+    def lookup(self, filename: str) -> Path | None:
+        # any file of this or an earlier build, which are never modified;
+        # precompressed siblings are only sent through content negotiation
+        if filename == MANIFEST or filename.endswith(tuple(s for _, s in ENCODINGS)):
+            return None
+        path = safe_join(str(self.folder()), filename)
+        return Path(path) if path is not None and os.path.isfile(path) else None
+
+    def asset_url(self, name: str) -> str:
+        self.load()
+        entry = self._assets.get(name)
+        return url_for('main.resources', filename=entry['path'] if entry else name)
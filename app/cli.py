@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import tarfile
+from pathlib import Path
+import click
+import sqlalchemy as sa
+from flask import Blueprint
+from app import db
+from app.models import FoundItem, User
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+
+@bp.cli.group()
+def images():
+    """Image maintenance commands."""
+    pass
+
+
+@images.command()
+def gc():
+    """Remove unused images and abandoned uploads."""
+    from app.main.image_files import collect_blobs, collect_item_images
+    for found_item in db.session.scalars(
+            sa.select(FoundItem).execution_options(yield_per=100)):
+        collect_item_images(found_item)
+    removed = collect_blobs()
+    click.echo(f'Removed {removed} unused images.')
+
+
+@images.command()
+@click.option('--older-than', type=int, default=None,
+              help='Seconds after which a job is considered lost '
+                   '[default: THUMBNAIL_JOB_TIMEOUT].')
+def recover(older_than):
+    """Requeue uploads whose thumbnails were never generated.
+
+    Jobs are lost when the worker that was given them exits before it
+    finishes, for instance during a restart."""
+    from flask import current_app
+    from app import image_worker
+    from app.main.image_files import recover_image_jobs
+    if older_than is None:
+        older_than = current_app.config['THUMBNAIL_JOB_TIMEOUT']
+    requeued, lost = recover_image_jobs(older_than)
+    image_worker.shutdown()
+    click.echo(f'Requeued {requeued} uploads, {lost} were lost.')
+
+
+@images.command()
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+              help='Number of worker processes.')
+@click.option('--force', is_flag=True, help='Regenerate thumbnails that are up to date.')
+def thumbnails(workers, force):
+    """Generate missing or outdated thumbnails and perceptual hashes.
+
+    Images whose thumbnails match the current settings are skipped, so an
+    interrupted run continues where it stopped when started again."""
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    from flask import current_app
+    from app import storage
+    from app.main.image_files import generate_thumbnails, safe_rmtree, \
+        thumbnail_sources, thumbnails_current, to_signed
+    from app.main.image_variants import variant_cache_dir
+    from app.models import ImageBlob
+    sizes = current_app.config['THUMBNAIL_SIZES']
+    quality = current_app.config['THUMBNAIL_QUALITY']
+    pending, missing = [], 0
+    for path, format, version, sha256, hashed in thumbnail_sources():
+        if not path.is_file():
+            missing += 1
+        elif force or not thumbnails_current(path, sizes, quality) or (sha256 and not hashed):
+            pending.append((path, format, version, sha256))
+    if missing:
+        click.echo(f'{missing} originals are missing and were skipped.')
+    total = len(pending)
+    click.echo(f'{total} images need thumbnails.')
+
+    done = failed = 0
+    start = last_report = time.monotonic()
+    queue = iter(pending)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while True:
+            # a few jobs per worker in flight keeps the pool busy without
+            # queueing the whole backlog
+            while len(running) < workers * 4 and (job := next(queue, None)):
+                path, format, version, sha256 = job
+                running[pool.submit(generate_thumbnails, path, sizes, format,
+                                    quality)] = job
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, format, version, sha256 = running.pop(future)
+                phash = future.result() if future.exception() is None else None
+                if phash is None:
+                    failed += 1
+                    click.echo(f'Failed: {path}')
+                    continue
+                done += 1
+                if sha256:
+                    db.session.execute(sa.update(ImageBlob)
+                                       .where(ImageBlob.sha256 == sha256)
+                                       .values(phash=to_signed(phash)))
+                    db.session.commit()
+                storage.store_tree(path.parent)
+                # variants rendered from the old thumbnails are stale
+                if version:
+                    safe_rmtree(Path(variant_cache_dir(), version[:2], version))
+            now = time.monotonic()
+            if now - last_report >= 5 or not running:
+                last_report = now
+                click.echo(f'{done + failed}/{total} images, '
+                           f'{(done + failed) / max(now - start, 1e-6):.1f}/s')
+    click.echo(f'Generated thumbnails for {done} images, {failed} failed.')
+
+
+@bp.cli.group()
+def assets():
+    """Static asset commands."""
+    pass
+
+
+@assets.command()
+def build():
+    """Fingerprint and precompress the resources and write the manifest."""
+    from flask import current_app
+    from app.assets import build_assets
+    assert current_app.static_folder is not None
+    static = Path(current_app.static_folder)
+    manifest = build_assets(Path(static, current_app.config['RESOURCES_FOLDER']),
+                            Path(static, current_app.config['ASSETS_FOLDER']))
+    for name, entry in sorted(manifest.items()):
+        encodings = ', '.join(entry['encodings'])
+        click.echo(f'{name} -> {entry["path"]}' + (f' ({encodings})' if encodings else ''))
+    click.echo(f'Built {len(manifest)} assets.')
+
+
+@bp.cli.group()
+def mail():
+    """Outgoing mail commands."""
+    pass
+
+
+@mail.command()
+def status():
+    """Show the state of the mail outbox."""
+    from app import outbox
+    for name, value in outbox.stats().items():
+        click.echo(f'{name}: {value:g}')
+
+
+@mail.command()
+def send():
+    """Deliver all messages that are due now."""
+    from app import outbox
+    total = 0
+    while sent := outbox.deliver():
+        total += sent
+    click.echo(f'Processed {total} messages.')
+
+
+@mail.command()
+def purge():
+    """Delete messages delivered more than MAIL_SENT_RETENTION_DAYS ago."""
+    from app import outbox
+    click.echo(f'Purged {outbox.purge()} delivered messages.')
+
+
+@bp.cli.group()
+def items():
+    """Found item import and export commands."""
+    pass
+
+
+@items.command('export')
+@click.argument('output', default='-')
+@click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']),
+              help='Output format, guessed from the file name by default.')
+@click.option('--images', 'images_path', type=click.Path(dir_okay=False),
+              help='Also write the images to this tar file.')
+def export_items(output, format, images_path):
+    """Write all found items to OUTPUT ('-' for stdout)."""
+    from app.transfer import export_records, guess_format, write_records
+    format = format or guess_format(output)
+    images = tarfile.open(images_path, 'w') if images_path else None
+    try:
+        with click.open_file(output, 'w', encoding='utf-8', lazy=False) as out:
+            count = write_records(export_records(images), out, format)
+    finally:
+        if images is not None:
+            images.close()
+    click.echo(f'Exported {count} found items.', err=True)
+
+
+@items.command('archive')
+@click.option('--days', type=int, help='Archive items closed at least this many days '
+                                       'ago, ARCHIVE_AFTER_DAYS by default.')
+@click.option('--batch-size', default=100, show_default=True)
+def archive_items(days, batch_size):
+    """Move closed found items and their originals to the archive.
+
+    Meant to run on a schedule; run `flask images gc` afterwards to remove
+    the images that are no longer used."""
+    from datetime import datetime, timedelta, timezone
+    from flask import current_app
+    from app.archive import archive_found_items
+    days = current_app.config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+    done = archive_found_items(before, batch_size,
+                               progress=lambda n: click.echo(f'{n} items archived'))
+    click.echo(f'Archived {done} found items.')
+
+
+@items.command('import')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['ndjson', 'csv']),
+              help='Input format, guessed from the file name by default.')
+@click.option('--images', 'images_path', type=click.Path(exists=True, dir_okay=False),
+              help='Tar file with the images referenced by the records.')
+@click.option('--reporter', help='Email of the user credited with records whose '
+                                 'reporter does not exist here.')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+              help='Progress file, SOURCE.checkpoint by default.')
+def import_items(source, format, images_path, reporter, batch_size, checkpoint_path):
+    """Load found items from SOURCE, resuming an interrupted import."""
+    from app import image_worker
+    from app.transfer import Checkpoint, ItemImporter, TransferError, guess_format, \
+        read_records
+    default_reporter_id = None
+    if reporter:
+        default_reporter_id = db.session.scalar(
+            sa.select(User.id).where(User.email == reporter))
+        if default_reporter_id is None:
+            raise click.BadParameter(f'No user with email {reporter}', param_hint='--reporter')
+    checkpoint = Checkpoint(Path(checkpoint_path or f'{source}.checkpoint'),
+                            str(Path(source).resolve()))
+    if checkpoint.done:
+        click.echo(f'Resuming after {checkpoint.done} records.', err=True)
+    images = tarfile.open(images_path, 'r:*') if images_path else None
+    importer = ItemImporter(images, default_reporter_id, batch_size)
+    try:
+        with open(source, encoding='utf-8', newline='') as f:
+            records = iter(read_records(f, format or guess_format(source)))
+            done = importer.run(records, checkpoint,
+                                progress=lambda n: click.echo(f'{n} records imported',
+                                                              err=True))
+        click.echo('Waiting for thumbnails...', err=True)
+        image_worker.shutdown()
+    except TransferError as e:
+        db.session.rollback()
+        click.echo(f'Import stopped: {e}', err=True)
+        sys.exit(1)
+    finally:
+        if images is not None:
+            images.close()
+    checkpoint.remove()
+    for name in importer.skipped_images:
+        click.echo(f'Skipped missing or invalid image {name}', err=True)
+    click.echo(f'Imported {done} found items.', err=True)
@@ -0,0 +1,81 @@
+import functools
+from typing import Any, Callable
+import sqlalchemy as sa
+from flask import Flask, g, has_request_context
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND = 'replica'
+
+
+def engine_options(app: Flask, url: str) -> dict[str, Any]:
+    if sa.engine.make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': app.config['DATABASE_POOL_SIZE'],
+        'max_overflow': app.config['DATABASE_MAX_OVERFLOW'],
+        'pool_timeout': app.config['DATABASE_POOL_TIMEOUT'],
+        'pool_recycle': app.config['DATABASE_POOL_RECYCLE'],
+        'pool_pre_ping': app.config['DATABASE_POOL_PRE_PING'],
+    }
+
+
+def configure_engines(app: Flask) -> None:
+    """Fill in pool settings for the primary and bound engines. Must run
+    before db.init_app(); explicit SQLALCHEMY_ENGINE_OPTIONS still win."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app, app.config['SQLALCHEMY_DATABASE_URI']),
+        **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}),
+    }
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for key, value in binds.items():
+        if isinstance(value, str):
+            binds[key] = {'url': value, **engine_options(app, value)}
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def install_sqlite_pragmas(app: Flask, engines: dict[str | None, sa.Engine]) -> None:
+    pragmas = {
+        'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+        'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+        'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT'],
+        'cache_size': app.config['SQLITE_CACHE_SIZE'],
+        'mmap_size': app.config['SQLITE_MMAP_SIZE'],
+    }
+
+    def on_connect(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if value is not None:
+                    cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+    for engine in engines.values():
+        if engine.dialect.name == 'sqlite':
+            sa.event.listen(engine, 'connect', on_connect)
+
+
+class RoutingSession(Session):
+    # Sends reads from views decorated with @use_replica to the replica bind
+    # when one is configured. Flushes and DML always go to the primary, so a
+    # view that ends up writing still works; it just cannot expect to read
+    # its own writes back through the replica.
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_request_context() \
+                and g.get('use_replica') and isinstance(clause, sa.Select):
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica(view: Callable) -> Callable:
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        g.use_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.use_replica = False
+    return wrapper
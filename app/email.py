@@ -1,17 +1,15 @@
-from threading import Thread
-from flask import current_app
-from flask_mail import Message
-from app import mail
+from app import db, outbox
+from app.models import OutboxMessage
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+def queue_email(subject, sender, recipients, text_body, html_body):
+    # joins the caller's transaction; the outbox picks it up after commit
+    db.session.add(OutboxMessage(subject=subject, sender=sender,
+                                 recipients=list(recipients),
+                                 text_body=text_body, html_body=html_body))
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    msg.html = html_body
-    Thread(target=send_async_email,
-           args=(current_app._get_current_object(), msg)).start()  # type: ignore
+    queue_email(subject, sender, recipients, text_body, html_body)
+    db.session.commit()
+    outbox.wake()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, render_template
+from markupsafe import Markup
+
+
+class MemoryBackend:
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    # A cache file shared by all worker processes on the host. Reads never
+    # write, so entries are evicted oldest-stored first rather than LRU.
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        self._local = threading.local()
+        self._writes = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute('CREATE TABLE IF NOT EXISTS fragment '
+                         '(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> str | None:
+        try:
+            row = self.connection.execute(
+                'SELECT value FROM fragment WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        return row[0] if row else None
+
+    def set(self, key: str, value: str) -> None:
+        try:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO fragment (key, value, stored) VALUES (?, ?, ?)',
+                (key, value, time.time()))
+            self._writes += 1
+            if self._writes % self.PRUNE_INTERVAL == 0:
+                self.connection.execute(
+                    'DELETE FROM fragment WHERE key NOT IN '
+                    '(SELECT key FROM fragment ORDER BY stored DESC LIMIT ?)',
+                    (self.max_size,))
+        except sqlite3.Error:
+            # a busy cache is not worth failing the request over
+            pass
+
+    def clear(self) -> None:
+        self.connection.execute('DELETE FROM fragment')
+
+
+class FragmentCache:
+    # Caches rendered template fragments under keys that include the
+    # revision of what they render, so writes never have to delete entries:
+    # bumping FoundItem.revision makes the old entry unreachable and the
+    # backend ages it out.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.backend: MemoryBackend | SQLiteBackend | None = None
+        self._template_digests: dict[str, str] = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        backend = app.config['FRAGMENT_CACHE_BACKEND']
+        size = app.config['FRAGMENT_CACHE_SIZE']
+        if backend == 'memory':
+            self.backend = MemoryBackend(size)
+        elif backend == 'sqlite':
+            self.backend = SQLiteBackend(
+                os.path.join(app.instance_path, app.config['FRAGMENT_CACHE_FILE']), size)
+        elif backend:
+            raise ValueError(f'Unknown fragment cache backend {backend!r}')
+        app.extensions['fragment_cache'] = self
+        app.add_template_global(self.render_item_entry)
+
+    def template_digest(self, name: str) -> str:
+        # keeps entries from an older deploy's template from being served
+        assert self.app is not None
+        digest = None if self.app.debug else self._template_digests.get(name)
+        if digest is None:
+            source, _, _ = self.app.jinja_env.loader.get_source(self.app.jinja_env, name)
+            digest = hashlib.sha1(source.encode()).hexdigest()[:8]
+            self._template_digests[name] = digest
+        return digest
+
+    def render(self, template: str, key: str, **context) -> Markup:
+        from app import metrics
+        if self.backend is None:
+            return Markup(render_template(template, **context))
+        key = f'{template}:{self.template_digest(template)}:{key}'
+        html = self.backend.get(key)
+        if html is not None:
+            metrics.inc('fragment_cache_requests_total', {'result': 'hit'})
+            return Markup(html)
+        metrics.inc('fragment_cache_requests_total', {'result': 'miss'})
+        html = render_template(template, **context)
+        self.backend.set(key, html)
+        return Markup(html)
+
+    def render_item_entry(self, found_item) -> Markup:
+        return self.render('_item_entry.html', f'{found_item.id}:{found_item.revision}',
+                           found_item=found_item)
+
+    def clear(self) -> None:
+        if self.backend is not None:
+            self.backend.clear()
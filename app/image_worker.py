@@ -0,0 +1,122 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+from flask import Flask
+
+
+class ImageWorker:
+    # Runs image jobs in a process pool. Their callbacks open app contexts,
+    # commit and upload to storage, so they run on a completion thread of
+    # their own instead of the pool's management thread, which would stop
+    # collecting results while a callback blocks.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.max_workers = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._completions: queue.Queue | None = None
+        self._completion_thread: threading.Thread | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.max_workers = app.config['THUMBNAIL_WORKERS']
+        app.extensions['image_worker'] = self
+        atexit.register(self.shutdown)
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # pools and threads do not survive a fork, so each worker process
+        # gets its own
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                self._completions = queue.Queue()
+                self._completion_thread = threading.Thread(
+                    target=self._complete, args=(self._completions,),
+                    name='image-worker-completions', daemon=True)
+                self._completion_thread.start()
+                self._pid = os.getpid()
+            return self._executor
+
+    def submit(self, fn: Callable[..., Any], *args: Any,
+               callback: Callable[[Any], None] | None = None) -> None:
+        app = self.app
+        assert app is not None
+        start = time.perf_counter()
+
+        def done(result: Any) -> None:
+            from app import metrics
+            metrics.observe('image_job_duration_seconds', {'job': fn.__name__},
+                            time.perf_counter() - start)
+            if callback is not None:
+                with app.app_context():
+                    callback(result)
+
+        if self.max_workers <= 0:
+            done(fn(*args))
+            return
+
+        def on_future_done(future: Future) -> None:
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # a worker process died; the job stays queued in the
+                # database for `flask images recover`
+                app.logger.error('Image worker pool broke while running a job')
+                self._discard(executor)
+                return
+            except Exception:
+                app.logger.exception('Image processing job failed')
+                result = None
+            completions.put((done, result))
+
+        for _ in range(2):
+            executor = self.executor
+            completions = self._completions
+            try:
+                executor.submit(fn, *args).add_done_callback(on_future_done)
+                return
+            except BrokenProcessPool:
+                self._discard(executor)
+        app.logger.error('Image worker pool is broken, job left for recovery')
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, completions, thread = \
+                self._executor, self._completions, self._completion_thread
+            owned = self._pid == os.getpid()
+            self._executor = self._completions = self._completion_thread = None
+        if executor is None or not owned:
+            return
+        executor.shutdown(wait=True)
+        assert completions is not None and thread is not None
+        completions.put(None)
+        thread.join()
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        # the next job starts a new pool; callbacks already queued still run
+        with self._lock:
+            if self._executor is not executor:
+                return
+            completions = self._completions
+            self._executor = self._completions = self._completion_thread = None
+        executor.shutdown(wait=False)
+        if completions is not None:
+            completions.put(None)
+
+    def _complete(self, completions: queue.Queue) -> None:
+        while (item := completions.get()) is not None:
+            done, result = item
+            try:
+                done(result)
+            except Exception:
+                assert self.app is not None
+                self.app.logger.exception('Image processing callback failed')
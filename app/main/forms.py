@@ -1,9 +1,11 @@
+from flask import request
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired
-from wtforms import StringField, TextAreaField, DateField, SubmitField
-from wtforms.validators import DataRequired, Length, ValidationError
+from wtforms import StringField, TextAreaField, DateField, SubmitField, \
+    SelectMultipleField
+from wtforms.validators import DataRequired, Length, Optional, ValidationError
 from datetime import date
-from PIL import Image
+from app.uploads import ImageRejected, ingest_image
 
 
 class FoundItemForm(FlaskForm):
@@ -23,7 +25,50 @@ class FoundItemForm(FlaskForm):
 
     def validate_image_file(self, image_file):
         try:
-            img = Image.open(image_file.data)
-            img.verify()
-        except Exception:
-            raise ValidationError('Invalid image file.')
+            self.ingested_image = ingest_image(image_file.data)
+        except ImageRejected as e:
+            raise ValidationError(str(e))
+
+
+class LostItemForm(FlaskForm):
+    title = StringField('What did you lose?', validators=[DataRequired(), Length(max=140)])
+    description = TextAreaField('Description', validators=[Length(max=1000)])
+    date_lost = DateField('Date Lost', render_kw={"max": date.today()},
+                          validators=[Optional()])
+    location_lost = StringField('Where did you lose it?', validators=[Length(max=140)])
+    submit = SubmitField('Submit')
+
+    def validate_date_lost(self, date_lost):
+        if date_lost.data > date.today():
+            raise ValidationError('Date lost cannot be in the future.')
+
+
+class SearchForm(FlaskForm):
+    q = StringField('Search', validators=[DataRequired(), Length(max=200)])
+
+    def __init__(self, *args, **kwargs):
+        if 'formdata' not in kwargs:
+            kwargs['formdata'] = request.args
+        if 'meta' not in kwargs:
+            kwargs['meta'] = {'csrf': False}
+        super(SearchForm, self).__init__(*args, **kwargs)
+
+
+class SimilarImageForm(FlaskForm):
+    image_file = FileField('Photo of what you lost', validators=[FileRequired()])
+    submit = SubmitField('Find Similar Items')
+
+    def validate_image_file(self, image_file):
+        try:
+            self.ingested_image = ingest_image(image_file.data)
+        except ImageRejected as e:
+            raise ValidationError(str(e))
+
+
+class ReviewForm(FlaskForm):
+    # the checkboxes are rendered per item by the template
+    ids = SelectMultipleField('Items', coerce=int, validate_choice=False,
+                              validators=[DataRequired('Select at least one item.')])
+    publish = SubmitField('Publish')
+    close = SubmitField('Close')
+    reject = SubmitField('Reject')
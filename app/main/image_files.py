@@ -1,10 +1,24 @@
 from flask import current_app
-from werkzeug.datastructures import FileStorage
-from pathlib import Path
+from functools import partial
+from pathlib import Path, PurePosixPath
 from PIL import Image, ImageOps
+import hashlib
+import json
 import os
 import stat
 import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from app import db, image_worker, similarity_index, storage
+from app.models import FoundItem, ImageBlob, ImageJob
+from app.uploads import IMAGE_EXTENSIONS, IngestedImage
+
+STAGING_PREFIX = '.staging-'
+# records the settings an image's thumbnails were generated with
+THUMBNAIL_STAMP = '.thumbnails'
+LEGACY_IMAGE_FILES = ('image*', 'thumb_*')
 
 
 def safe_rmtree(path: Path | str) -> None:
@@ -16,45 +30,385 @@ def safe_rmtree(path: Path | str) -> None:
         shutil.rmtree(path, onerror=handle_remove_error)
 
 
-def upload_file(file: FileStorage, id: str) -> str | None:
-    if not file \
-        or not file.filename \
-            or file.filename == '' \
-            or not current_app.static_folder:
+def item_image_dir(id: int | str) -> Path:
+    assert current_app.static_folder is not None
+    return Path(current_app.static_folder, current_app.config['IMAGE_FOLDER'], str(id))
+
+
+def blob_root() -> Path:
+    assert current_app.static_folder is not None
+    return Path(current_app.static_folder, current_app.config['IMAGE_FOLDER'], 'blobs')
+
+
+def blob_dir(sha256: str) -> Path:
+    return Path(blob_root(), sha256[:2], sha256)
+
+
+def upload_file(image: IngestedImage,
+                found_item: FoundItem) -> tuple[Path, str, str] | None:
+    # Images are stored once per content hash. If this one has been
+    # published before, the item just takes a reference to it; otherwise the
+    # upload is moved into a private staging directory and only becomes
+    # visible once its thumbnails exist and the directory has been renamed
+    # into place, see publish_image(). An ImageJob row records the staged
+    # upload until then.
+    if not image or not current_app.static_folder:
         return None
-    ext = Path(file.filename).suffix
-    filedir = Path(current_app.static_folder, current_app.config['IMAGE_FOLDER'], id)
-
-    try:
-        if Path(filedir).exists():
-            safe_rmtree(filedir)
-        filedir.mkdir(parents=True)
-        filename = Path(filedir, f'image{ext}')
-        file.seek(0)
-        file.save(filename)
-        if (not generate_thumbnail(filename, 'small', (250, 250))) \
-                or (not generate_thumbnail(filename, 'large', (500, 500))):
-            raise Exception('Thumbnail generation failed')
-        return filename.name
+    blob = db.session.get(ImageBlob, image.sha256)
+    if blob is not None and blob.ready and blob_dir(blob.sha256).is_dir():
+        image.path.unlink(missing_ok=True)
+        set_found_item_image(found_item, blob)
+        return None
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                db.session.add(ImageBlob(sha256=image.sha256, format=image.format,
+                                         size=image.size, width=image.width,
+                                         height=image.height, ref_count=0,
+                                         ready=False))
+        except sa.exc.IntegrityError:
+            pass  # uploaded concurrently by another request
+
+    staging_dir = None
+    try:
+        blob_root().mkdir(parents=True, exist_ok=True)
+        staging_dir = Path(tempfile.mkdtemp(prefix=STAGING_PREFIX, dir=blob_root()))
+        filename = Path(staging_dir, f'image{image.ext}')
+        os.replace(image.path, filename)
+        found_item.image_processing = True
+        db.session.add(ImageJob(found_item_id=found_item.id, sha256=image.sha256,
+                                format=image.format, path=job_path(filename)))
+        return filename, image.sha256, image.format
     except Exception:
-        if Path(filedir).exists():
-            safe_rmtree(filedir)
+        if staging_dir is not None:
+            safe_rmtree(staging_dir)
         return None
 
 
-def generate_thumbnail(image_path: Path, desc: str, size: tuple[int, int]) -> str | None:
-    thumbnail_path = Path(image_path.parent, f'thumb_{desc}')
+def job_path(image_path: Path) -> str:
+    return image_path.relative_to(blob_root()).as_posix()
+
+
+def finish_image_job(id: int, image_path: Path) -> bool:
+    # returns whether the found item still has other uploads in progress
+    db.session.execute(sa.delete(ImageJob).where(ImageJob.found_item_id == id,
+                                                 ImageJob.path == job_path(image_path)))
+    return bool(db.session.scalar(sa.select(sa.exists().where(ImageJob.found_item_id == id))))
+
+
+def set_found_item_image(found_item: FoundItem, blob: ImageBlob) -> None:
+    if found_item.image_sha256 == blob.sha256:
+        return
+    release_found_item_image(found_item)
+    db.session.execute(
+        sa.update(ImageBlob)
+        .where(ImageBlob.sha256 == blob.sha256)
+        .values(ref_count=ImageBlob.ref_count + 1))
+    found_item.image_sha256 = blob.sha256
+    found_item.image_filename = f'image{IMAGE_EXTENSIONS[blob.format]}'
+
+
+def release_found_item_image(found_item: FoundItem) -> None:
+    # the grace period of an image that is no longer used starts now
+    if found_item.image_sha256:
+        db.session.execute(
+            sa.update(ImageBlob)
+            .where(ImageBlob.sha256 == found_item.image_sha256)
+            .values(ref_count=ImageBlob.ref_count - 1))
+        touch(blob_dir(found_item.image_sha256))
+    elif found_item.image_filename:
+        item_dir = item_image_dir(found_item.id)
+        for pattern in LEGACY_IMAGE_FILES:
+            for entry in item_dir.glob(pattern):
+                touch(entry)
+    found_item.image_sha256 = None
+    found_item.image_filename = None
+
+
+def touch(path: Path) -> None:
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def image_dir(found_item: FoundItem) -> Path:
+    assert found_item.image_filename is not None
+    if found_item.image_sha256:
+        return blob_dir(found_item.image_sha256)
+    # images stored per item, before the blob store
+    return Path(item_image_dir(found_item.id), found_item.image_filename).parent
+
+
+def image_path(found_item: FoundItem) -> Path:
+    assert found_item.image_filename is not None
+    return Path(image_dir(found_item), Path(found_item.image_filename).name)
+
+
+def image_version(found_item: FoundItem) -> str | None:
+    if not found_item.image_filename:
+        return None
+    if found_item.image_sha256:
+        return found_item.image_sha256[:16]
+    version = Path(found_item.image_filename).parent.name
+    if version:
+        return version
+    stem = Path(found_item.image_filename).stem
+    if stem.startswith('image-'):
+        return stem[len('image-'):]
     try:
-        with Image.open(image_path) as img:
-            img = ImageOps.exif_transpose(img)
-            img.thumbnail(size, Image.Resampling.LANCZOS)
-            if Path(thumbnail_path).exists():
-                safe_rmtree(thumbnail_path)
-            thumbnail_path.mkdir()
-            thumbnail_path = Path(thumbnail_path, 'thumb.jpg')
-            img.save(thumbnail_path, format="JPEG")
-            return thumbnail_path.name
+        st = image_path(found_item).stat()
+    except OSError:
+        return None
+    return f'{st.st_mtime_ns:x}{st.st_size:x}'
+
+
+def thumbnail_version(found_item: FoundItem) -> str | None:
+    # thumbnails are regenerated in place when the settings change, so
+    # their URLs and ETags carry the settings as well as the image
+    version = image_version(found_item)
+    if version is None:
+        return None
+    stamp = thumbnail_stamp(current_app.config['THUMBNAIL_SIZES'],
+                            current_app.config['THUMBNAIL_QUALITY'])
+    return f'{version}-{stamp[:8]}'
+
+
+def schedule_thumbnails(id: int, image_path: Path, sha256: str,
+                        format: str | None = None) -> None:
+    image_worker.submit(generate_thumbnails, image_path,
+                        current_app.config['THUMBNAIL_SIZES'], format,
+                        current_app.config['THUMBNAIL_QUALITY'],
+                        callback=partial(publish_image, id, image_path, sha256))
+
+
+def publish_image(id: int, image_path: Path, sha256: str,
+                  phash: int | None) -> None:
+    staging_dir = image_path.parent
+    blob = db.session.get(ImageBlob, sha256)
+    generated = phash is not None
+    if generated and blob is not None:
+        target = blob_dir(sha256)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.rename(staging_dir, target)
+        except OSError:
+            # published concurrently by another upload of the same image
+            if not target.is_dir():
+                raise
+            safe_rmtree(staging_dir)
+        storage.store_tree(target)
+        blob.ready = True
+        blob.phash = to_signed(phash)
+    else:
+        current_app.logger.error(f'Thumbnail generation failed for found item {id}')
+        safe_rmtree(staging_dir)
+    processing = finish_image_job(id, image_path)
+    found_item = db.session.get(FoundItem, id)
+    if found_item is not None:
+        found_item.image_processing = processing
+        found_item.bump_revision()
+        if generated and blob is not None:
+            set_found_item_image(found_item, blob)
+    db.session.commit()
+    if found_item is not None:
+        similarity_index.update([id])
+        collect_item_images(found_item)
+
+
+def recover_image_jobs(older_than: int) -> tuple[int, int]:
+    """Requeue thumbnail jobs queued more than `older_than` seconds ago,
+    which the worker that was given them has lost. Returns how many were
+    requeued and how many were dropped because their upload is gone."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    jobs = db.session.scalars(
+        sa.select(ImageJob)
+        .where(ImageJob.created < now - timedelta(seconds=older_than))
+        .order_by(ImageJob.id)).all()
+    requeued, lost = [], 0
+    for job in jobs:
+        path = Path(blob_root(), job.path)
+        if path.is_file():
+            # the timeout starts again, so a slow job is not requeued twice
+            job.created = now
+            requeued.append((job.found_item_id, path, job.sha256, job.format))
+            continue
+        current_app.logger.error(f'Upload of found item {job.found_item_id} was lost')
+        lost += 1
+        if not finish_image_job(job.found_item_id, path):
+            found_item = db.session.get(FoundItem, job.found_item_id)
+            if found_item is not None:
+                found_item.image_processing = False
+                found_item.bump_revision()
+    db.session.commit()
+    for args in requeued:
+        schedule_thumbnails(*args)
+    return len(requeued), lost
+
+
+def collect_item_images(found_item: FoundItem) -> None:
+    # removes what is left of per-item image directories once they are
+    # superseded, along with abandoned uploads from before the blob store
+    item_dir = item_image_dir(found_item.id)
+    if not item_dir.is_dir():
+        return
+    legacy = not found_item.image_sha256 and found_item.image_filename
+    current = image_dir(found_item) if legacy else None
+    current_files = {Path(found_item.image_filename or '').name} \
+        if current == item_dir else set()
+    expired = time.time() - current_app.config['IMAGE_VERSION_GRACE']
+    for entry in item_dir.iterdir():
+        if entry == current or entry.name in current_files:
+            continue
+        if current == item_dir and (entry.name.startswith('thumb_')
+                                    or entry.name == THUMBNAIL_STAMP):
+            continue
+        expire(entry, expired)
+    try:
+        item_dir.rmdir()
+    except OSError:
+        pass
+
+
+def collect_blobs() -> int:
+    expired = time.time() - current_app.config['IMAGE_VERSION_GRACE']
+    created_before = datetime.now(timezone.utc).replace(tzinfo=None) - \
+        timedelta(seconds=current_app.config['IMAGE_VERSION_GRACE'])
+    removed = 0
+    # uploads still waiting for thumbnails hold no reference yet, but their
+    # blobs and staging directories are in use until the job finishes
+    pending = sa.select(ImageJob.sha256)
+    unused = db.session.scalars(
+        sa.select(ImageBlob.sha256)
+        .where(ImageBlob.ref_count <= 0, ImageBlob.created < created_before,
+               ImageBlob.sha256.not_in(pending))).all()
+    for sha256 in unused:
+        path = blob_dir(sha256)
+        try:
+            if path.stat().st_mtime > expired:
+                continue
+        except OSError:
+            pass
+        deleted = db.session.execute(
+            sa.delete(ImageBlob)
+            .where(ImageBlob.sha256 == sha256, ImageBlob.ref_count <= 0,
+                   ImageBlob.sha256.not_in(pending)))
+        db.session.commit()
+        if deleted.rowcount:
+            safe_rmtree(path)
+            storage.remove_tree(path)
+            removed += 1
+    if blob_root().is_dir():
+        staged = {PurePosixPath(path).parts[0]
+                  for path in db.session.scalars(sa.select(ImageJob.path))}
+        for entry in blob_root().glob(f'{STAGING_PREFIX}*'):
+            if entry.name not in staged:
+                expire(entry, expired)
+    return removed
+
+
+def expire(entry: Path, expired: float) -> bool:
+    try:
+        if entry.stat().st_mtime > expired:
+            return False
+    except OSError:
+        return False
+    if entry.is_dir():
+        safe_rmtree(entry)
+    else:
+        entry.unlink(missing_ok=True)
+    return True
+
+
+def thumbnail_stamp(sizes: dict[str, tuple[int, int]], quality: int) -> str:
+    settings = json.dumps([sorted(sizes.items()), quality])
+    return hashlib.sha1(settings.encode()).hexdigest()[:16]
+
+
+def thumbnails_current(image_path: Path, sizes: dict[str, tuple[int, int]],
+                       quality: int) -> bool:
+    try:
+        stamp = Path(image_path.parent, THUMBNAIL_STAMP).read_text()
+    except OSError:
+        return False
+    return stamp == thumbnail_stamp(sizes, quality) and all(
+        Path(image_path.parent, f'thumb_{desc}', 'thumb.jpg').is_file() for desc in sizes)
+
+
+def replace_atomically(target: Path, write) -> None:
+    tmp = target.with_name(f'.{target.name}.{os.getpid()}')
+    try:
+        write(tmp)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def dhash(img: Image.Image) -> int:
+    # difference hash: one bit per horizontally adjacent pixel pair of a
+    # 9x8 grayscale reduction, robust to scaling and recompression
+    small = img.convert('L').resize((9, 8), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def image_hash(image_path: Path, format: str | None = None) -> int:
+    with Image.open(image_path, formats=[format] if format else None) as img:
+        img.draft('RGB', (64, 64))
+        return dhash(ImageOps.exif_transpose(img))
+
+
+def to_signed(value: int) -> int:
+    # 64-bit hashes are stored in a signed BIGINT column
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def generate_thumbnails(image_path: Path, sizes: dict[str, tuple[int, int]],
+                        format: str | None = None, quality: int = 75) -> int | None:
+    # Runs in the image worker pool: the original is decoded once and every
+    # thumbnail is derived from it, largest first, so each resize works on
+    # the smallest image that still has enough pixels. Each file is replaced
+    # atomically, so thumbnails being regenerated stay servable throughout.
+    # Returns the perceptual hash of the image, or None if it failed.
+    try:
+        with Image.open(image_path, formats=[format] if format else None) as img:
+            largest = max(max(size) for size in sizes.values())
+            img.draft('RGB', (largest, largest))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            phash = dhash(img)
+            for desc, size in sorted(sizes.items(),
+                                     key=lambda s: s[1][0] * s[1][1], reverse=True):
+                img.thumbnail(size, Image.Resampling.LANCZOS)
+                thumbnail_path = Path(image_path.parent, f'thumb_{desc}')
+                thumbnail_path.mkdir(exist_ok=True)
+                replace_atomically(Path(thumbnail_path, 'thumb.jpg'),
+                                   lambda tmp: img.save(tmp, format='JPEG', quality=quality))
+        replace_atomically(Path(image_path.parent, THUMBNAIL_STAMP),
+                           lambda tmp: tmp.write_text(thumbnail_stamp(sizes, quality)))
+        return phash
     except Exception:
-        if Path(thumbnail_path).exists():
-            safe_rmtree(thumbnail_path)
         return None
+
+
+def thumbnail_sources():
+    """Yield (image path, format, version, blob sha256, has phash) for every
+    stored original."""
+    for sha256, format, phash in db.session.execute(
+            sa.select(ImageBlob.sha256, ImageBlob.format, ImageBlob.phash)
+            .where(ImageBlob.ready)
+            .execution_options(yield_per=500)):
+        yield (Path(blob_dir(sha256), f'image{IMAGE_EXTENSIONS[format]}'), format,
+               sha256[:16], sha256, phash is not None)
+    for found_item in db.session.scalars(
+            sa.select(FoundItem)
+            .where(FoundItem.image_filename.is_not(None), FoundItem.image_sha256.is_(None))
+            .execution_options(yield_per=500)):
+        yield image_path(found_item), None, image_version(found_item), None, False
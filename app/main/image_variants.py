@@ -0,0 +1,161 @@
+from flask import current_app
+from werkzeug.datastructures import MIMEAccept
+from pathlib import Path
+from PIL import Image, ImageOps, features
+import os
+import threading
+import time
+from app import metrics
+from app.models import FoundItem
+from app.main.image_files import image_dir, image_path, image_version
+
+# Server preference order; a format is only chosen when the client lists it
+# explicitly, so clients sending */* keep getting JPEG.
+VARIANT_FORMATS = {
+    'avif': ('image/avif', 'AVIF', {'quality': 55}),
+    'webp': ('image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('image/jpeg', 'JPEG', {'quality': 85, 'optimize': True}),
+}
+VARIANT_LOCK_TIMEOUT = 30
+VARIANT_TOUCH_INTERVAL = 60 * 60
+
+_cache_lock = threading.Lock()
+_cache_bytes: dict[Path, int] = {}
+
+
+def supported_formats() -> list[str]:
+    return [fmt for fmt in VARIANT_FORMATS
+            if fmt == 'jpeg' or features.check(fmt)]
+
+
+def negotiate_format(accept: MIMEAccept) -> str:
+    offered = set(accept.values())
+    for fmt in supported_formats():
+        mimetype = VARIANT_FORMATS[fmt][0]
+        if mimetype in offered and accept[mimetype] > 0:
+            return fmt
+    return 'jpeg'
+
+
+def thumbnail_width(size: str) -> int | None:
+    sizes = current_app.config['THUMBNAIL_SIZES']
+    if size in sizes:
+        return max(sizes[size])
+    if size.isdigit() and int(size) in current_app.config['THUMBNAIL_WIDTHS']:
+        return int(size)
+    return None
+
+
+def variant_cache_dir() -> Path:
+    assert current_app.static_folder is not None
+    return Path(current_app.static_folder, current_app.config['THUMBNAIL_CACHE_FOLDER'])
+
+
+def thumbnail_file(found_item: FoundItem, width: int, fmt: str) -> Path | None:
+    # The pre-generated JPEG thumbnails are served as they are; anything
+    # else is rendered on first use into the variant cache, from the
+    # smallest pre-generated thumbnail that is large enough, or the original.
+    sources = sorted((max(box), desc) for desc, box
+                     in current_app.config['THUMBNAIL_SIZES'].items())
+    for box_width, desc in sources:
+        if box_width >= width:
+            source = Path(image_dir(found_item), f'thumb_{desc}', 'thumb.jpg')
+            if box_width == width and fmt == 'jpeg':
+                return source
+            break
+    else:
+        source = image_path(found_item)
+    if not source.is_file():
+        return None
+    version = image_version(found_item)
+    target = Path(variant_cache_dir(), str(version)[:2], str(version), f'{width}.{fmt}')
+    return cached_variant(source, target, width, fmt)
+
+
+def cached_variant(source: Path, target: Path, width: int, fmt: str) -> Path:
+    try:
+        st = target.stat()
+        if time.time() - st.st_mtime > VARIANT_TOUCH_INTERVAL:
+            os.utime(target)
+        return target
+    except OSError:
+        pass
+
+    # a lock file next to the target lets one thread of one process render
+    # the variant while concurrent requests for it wait for the result
+    target.parent.mkdir(parents=True, exist_ok=True)
+    lock = target.with_name(target.name + '.lock')
+    locked = False
+    deadline = time.monotonic() + VARIANT_LOCK_TIMEOUT
+    while not locked:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            locked = True
+        except FileExistsError:
+            if target.exists():
+                return target
+            try:
+                if time.time() - lock.stat().st_mtime > VARIANT_LOCK_TIMEOUT:
+                    lock.unlink(missing_ok=True)
+                    continue
+            except OSError:
+                continue
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.05)
+    try:
+        if not target.exists():
+            with metrics.timer('thumbnail_render_duration_seconds', format=fmt):
+                render_variant(source, target, width, fmt)
+            account_variant(target.stat().st_size)
+    finally:
+        if locked:
+            lock.unlink(missing_ok=True)
+    return target
+
+
+def render_variant(source: Path, target: Path, width: int, fmt: str) -> None:
+    _, pil_format, options = VARIANT_FORMATS[fmt]
+    tmp = target.with_name(f'.{target.name}.{os.getpid()}.{threading.get_ident()}')
+    try:
+        with Image.open(source) as img:
+            img.draft('RGB', (width, width))
+            img = ImageOps.exif_transpose(img).convert('RGB')
+            img.thumbnail((width, width), Image.Resampling.LANCZOS)
+            img.save(tmp, format=pil_format, **options)
+        os.replace(tmp, target)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def account_variant(size: int) -> None:
+    cache_dir = variant_cache_dir()
+    limit = current_app.config['THUMBNAIL_CACHE_MAX_BYTES']
+    with _cache_lock:
+        if cache_dir not in _cache_bytes:
+            _cache_bytes[cache_dir] = sum(f.stat().st_size for f in cache_dir.rglob('*')
+                                          if f.is_file())
+        else:
+            _cache_bytes[cache_dir] += size
+        if _cache_bytes[cache_dir] <= limit:
+            return
+        _cache_bytes[cache_dir] = evict_variants(cache_dir, int(limit * 0.9))
+
+
+def evict_variants(cache_dir: Path, target_bytes: int) -> int:
+    # least recently used first; hits refresh the mtime of a variant
+    files = []
+    for f in cache_dir.rglob('*'):
+        try:
+            if f.is_file() and not f.name.endswith('.lock'):
+                st = f.stat()
+                files.append((st.st_mtime, st.st_size, f))
+        except OSError:
+            pass
+    total = sum(size for _, size, _ in files)
+    for _, size, f in sorted(files, key=lambda f: f[0]):
+        if total <= target_bytes:
+            break
+        f.unlink(missing_ok=True)
+        total -= size
+    return total
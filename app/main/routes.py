@@ -1,44 +1,101 @@
-from datetime import datetime, timezone, time
+import io
+import mimetypes
+from datetime import datetime, time, timezone
 from flask import render_template, flash, redirect, request, url_for, current_app, \
-    send_from_directory
+    send_file, abort, g
 from flask_login import current_user, login_required
 from typing import cast
+import sqlalchemy as sa
+import sqlalchemy.orm as so
 from pathlib import Path
-from app import db
+from werkzeug.security import safe_join
+from app import db, activity, similarity_index, outbox, storage, assets
 from app.main import bp
-from app.models import User, FoundItem, FoundItemStatus
-from app.main.image_files import upload_file
-from app.main.forms import FoundItemForm
+from app.models import User, FoundItem, FoundItemStatus, LISTED_STATUSES, LostItem, \
+    LostItemStatus, LostItemMatch, ArchivedFoundItem
+from app.pagination import paginate_found_items
+from app.main.image_files import upload_file, schedule_thumbnails, image_version, \
+    image_path, image_hash, thumbnail_version
+from app.main.image_variants import negotiate_format, thumbnail_file, thumbnail_width
+from app.main.forms import FoundItemForm, SearchForm, ReviewForm, SimilarImageForm, \
+    LostItemForm
+from app.search import search_found_items
+from app.matching import match_found_items, index_lost_item, unindex_lost_item
+from app.archive import ARCHIVE_THUMBNAIL, archived_thumbnail_path, read_archived_image
+from app.assets import ENCODINGS, compressible
+from app.query_monitor import query_budget
+from app.database import use_replica
+from app.page_cache import cache_page
 
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        activity.touch(current_user.id, current_user.last_seen)
+    g.search_form = SearchForm()
 
 
 @bp.route('/', methods=['GET'])
 @bp.route('/index', methods=['GET'])
+@cache_page
+# one keyset query per status
+@query_budget(3, repeats=3)
+@use_replica
 def index():
-    page = request.args.get('page', 1, type=int)
-    found_items = db.paginate(
-        db.select(FoundItem)
-        .order_by(FoundItem.date_found.desc()),
-        page=page,
-        per_page=current_app.config['ITEMS_PER_PAGE'],
-        error_out=False
+    found_items = paginate_found_items(
+        request.args.get('cursor'),
+        per_page=current_app.config['ITEMS_PER_PAGE']
     )
-    next_url = url_for('main.index', page=found_items.next_num) \
+    next_url = url_for('main.index', cursor=found_items.next_cursor) \
         if found_items.has_next else None
-    prev_url = url_for('main.index', page=found_items.prev_num) \
+    prev_url = url_for('main.index', cursor=found_items.prev_cursor) \
         if found_items.has_prev else None
     return render_template('index.html', title='Home', found_items=found_items,
                            next_url=next_url, prev_url=prev_url)
 
 
+@bp.route('/search', methods=['GET'])
+@query_budget(1)
+def search():
+    if not g.search_form.validate():
+        return redirect(url_for('main.index'))
+    q = g.search_form.q.data
+    page = request.args.get('page', 1, type=int)
+    found_items, has_next = search_found_items(
+        q, page, current_app.config['SEARCH_RESULTS_PER_PAGE'])
+    next_url = url_for('main.search', q=q, page=page + 1) \
+        if has_next else None
+    prev_url = url_for('main.search', q=q, page=page - 1) \
+        if page > 1 else None
+    return render_template('search.html', title='Search', found_items=found_items,
+                           next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/similar', methods=['GET', 'POST'])
+@query_budget(2)
+def similar_items():
+    form = SimilarImageForm()
+    found_items = None
+    if form.validate_on_submit():
+        image = form.ingested_image
+        try:
+            phash = image_hash(image.path, image.format)
+        finally:
+            image.path.unlink(missing_ok=True)
+        matches = similarity_index.search(phash,
+                                          current_app.config['SIMILAR_MAX_DISTANCE'],
+                                          current_app.config['SIMILAR_RESULTS'])
+        ids = [id for _, id in matches]
+        by_id = {found_item.id: found_item for found_item in db.session.scalars(
+            sa.select(FoundItem).where(FoundItem.id.in_(ids)))} if ids else {}
+        found_items = [by_id[id] for id in ids if id in by_id]
+    return render_template('similar.html', title='Find Similar Items', form=form,
+                           found_items=found_items)
+
+
 @bp.route('/found_item', methods=['GET', 'POST'])
 @login_required
+@query_budget(8)
 def add_found_item():
     form = FoundItemForm()
     if form.validate_on_submit():
@@ -50,45 +107,58 @@ def add_found_item():
         found_item.location_found = form.location_found.data
         found_item.reporter = cast(User, current_user)
         found_item.status = FoundItemStatus.REVIEW
+        found_item.bump_revision()
         db.session.add(found_item)
         db.session.flush()
-        image_filename = upload_file(request.files['image_file'], str(found_item.id))
-        if image_filename:
-            found_item.image_filename = str(image_filename)
+        staged_image = upload_file(form.ingested_image, found_item)
         db.session.commit()
+        if staged_image:
+            schedule_thumbnails(found_item.id, *staged_image)
         flash('Found item submitted successfully!')
         return redirect(url_for('main.index'))
     return render_template('edit_found_item.html', title='Report Found Item', form=form)
 
 
 @bp.route('/found_item/<int:id>', methods=['GET'])
+@cache_page
+# archived items take a second lookup
+@query_budget(2)
+@use_replica
 def found_item(id):
-    found_item = FoundItem.query.get_or_404(id)
+    found_item = db.session.get(FoundItem, id, options=[so.joinedload(FoundItem.reporter)])
+    if found_item is None:
+        archived_item = db.get_or_404(ArchivedFoundItem, id,
+                                      options=[so.joinedload(ArchivedFoundItem.reporter)])
+        return render_template('found_item.html', title='Found Item Details',
+                               found_item=archived_item, archived=True,
+                               current_user=current_user)
     return render_template('found_item.html', title='Found Item Details',
                            found_item=found_item, current_user=current_user)
 
 
 @bp.route('/found_item/<int:id>/update', methods=['GET', 'POST'])
 @login_required
+@query_budget(9)
 def update_found_item(id):
-    found_item = FoundItem.query.get_or_404(id)
+    found_item = db.get_or_404(FoundItem, id, options=[so.joinedload(FoundItem.reporter)])
     if found_item.reporter != current_user and not current_user.is_admin:
         flash('You are not authorized to update this found item.')
         return redirect(url_for('main.found_item', id=id))
     form = FoundItemForm()
     if form.validate_on_submit():
-        found_item = FoundItem()
         found_item.title = form.title.data if form.title.data else ''
         found_item.description = form.description.data
         found_item.date_found = datetime.combine(form.date_found.data, time()) \
             if form.date_found.data else None
         found_item.location_found = form.location_found.data
-        found_item.reporter = cast(User, current_user)
         found_item.status = FoundItemStatus.REVIEW
-        image_filename = upload_file(request.files['image_file'], str(found_item.id))
-        if image_filename:
-            found_item.image_filename = image_filename
+        found_item.bump_revision()
+        staged_image = upload_file(form.ingested_image, found_item)
         db.session.commit()
+        # back in review, the item is no longer public
+        similarity_index.discard([id])
+        if staged_image:
+            schedule_thumbnails(found_item.id, *staged_image)
         flash('Found item updated successfully!')
         return redirect(url_for('main.found_item', id=id))
     elif request.method == 'GET':
@@ -104,45 +174,257 @@ def update_found_item(id):
 
 @bp.route('/found_item/<int:id>/publish', methods=['POST'])
 @login_required
+# update, lost report matching and the queued notifications
+@query_budget(6)
 def publish_found_item(id):
-    found_item = FoundItem.query.get_or_404(id)
     if not current_user.is_admin:
         flash('You are not authorized to publish this found item.')
         return redirect(url_for('main.found_item', id=id))
-    found_item.status = FoundItemStatus.PUBLISHED
-    db.session.commit()
-    flash('Found item published successfully!')
+    if moderate_found_items([id], FoundItemStatus.PUBLISHED):
+        flash('Found item published successfully!')
+    else:
+        flash('This found item is not awaiting review.')
     return redirect(url_for('main.found_item', id=id))
 
 
-@bp.route('/images/<id>')
+@bp.route('/review', methods=['GET', 'POST'])
+@login_required
+@query_budget(6)
+def review_queue():
+    if not current_user.is_admin:
+        flash('You are not authorized to review found items.')
+        return redirect(url_for('main.index'))
+    form = ReviewForm()
+    if form.validate_on_submit():
+        status = FoundItemStatus.PUBLISHED if form.publish.data else \
+            FoundItemStatus.CLOSED if form.close.data else FoundItemStatus.REJECTED
+        count = len(moderate_found_items(form.ids.data, status))
+        flash(f'{count} found item{"" if count == 1 else "s"} {status.value}.')
+        return redirect(url_for('main.review_queue', cursor=request.args.get('cursor')))
+    for error in form.ids.errors:
+        flash(error)
+    found_items = paginate_found_items(
+        request.args.get('cursor'),
+        per_page=current_app.config['REVIEW_ITEMS_PER_PAGE'],
+        statuses=(FoundItemStatus.REVIEW, FoundItemStatus.PUBLISHED))
+    next_url = url_for('main.review_queue', cursor=found_items.next_cursor) \
+        if found_items.has_next else None
+    prev_url = url_for('main.review_queue', cursor=found_items.prev_cursor) \
+        if found_items.has_prev else None
+    return render_template('review.html', title='Review Queue', form=form,
+                           found_items=found_items, next_url=next_url, prev_url=prev_url)
+
+
+@bp.route('/lost_item', methods=['GET', 'POST'])
+@login_required
+@query_budget(3)
+def add_lost_item():
+    form = LostItemForm()
+    if form.validate_on_submit():
+        lost_item = LostItem()
+        lost_item.title = form.title.data
+        lost_item.description = form.description.data
+        lost_item.date_lost = datetime.combine(form.date_lost.data, time()) \
+            if form.date_lost.data else None
+        lost_item.location_lost = form.location_lost.data
+        lost_item.owner = cast(User, current_user)
+        db.session.add(lost_item)
+        db.session.flush()
+        index_lost_item(lost_item)
+        db.session.commit()
+        flash('Lost item reported. We will email you when a matching item is found.')
+        return redirect(url_for('main.lost_items'))
+    return render_template('edit_lost_item.html', title='Report Lost Item', form=form)
+
+
+@bp.route('/lost_items', methods=['GET'])
+@login_required
+@query_budget(2)
+def lost_items():
+    reports = db.session.scalars(
+        cast(User, current_user).lost_items.select()
+        .order_by(LostItem.created.desc())).all()
+    matches = db.session.scalars(
+        sa.select(LostItemMatch)
+        .where(LostItemMatch.lost_item_id.in_([report.id for report in reports]))
+        .options(so.joinedload(LostItemMatch.found_item))
+        .order_by(LostItemMatch.score.desc())).all()
+    found_items: dict[int, list[FoundItem]] = {report.id: [] for report in reports}
+    for match in matches:
+        if match.found_item.status in LISTED_STATUSES:
+            found_items[match.lost_item_id].append(match.found_item)
+    return render_template('lost_items.html', title='My Lost Items', reports=reports,
+                           found_items=found_items)
+
+
+@bp.route('/lost_item/<int:id>/close', methods=['POST'])
+@login_required
+@query_budget(3)
+def close_lost_item(id):
+    lost_item = db.get_or_404(LostItem, id)
+    if lost_item.user_id != current_user.id:
+        flash('You are not authorized to close this lost item report.')
+        return redirect(url_for('main.lost_items'))
+    lost_item.status = LostItemStatus.CLOSED
+    unindex_lost_item(lost_item)
+    db.session.commit()
+    flash('Lost item report closed.')
+    return redirect(url_for('main.lost_items'))
+
+
+def moderate_found_items(ids: list[int], status: FoundItemStatus) -> list[int]:
+    # One set-based UPDATE in one transaction. Only items still awaiting
+    # review change, or published ones when closing, so two admins working
+    # the queue cannot undo each other. The revision bump retires cached
+    # fragments and the bulk UPDATE invalidates the page cache. Newly
+    # published items are matched against open lost reports before the
+    # same commit.
+    values = {'status': status, 'revision': FoundItem.revision + 1}
+    if status == FoundItemStatus.PUBLISHED:
+        values['published'] = sa.func.coalesce(
+            FoundItem.published, datetime.now(timezone.utc).replace(tzinfo=None))
+    current = (FoundItemStatus.REVIEW, FoundItemStatus.PUBLISHED) \
+        if status == FoundItemStatus.CLOSED else (FoundItemStatus.REVIEW,)
+    rows = db.session.execute(
+        sa.update(FoundItem)
+        .where(FoundItem.id.in_(ids), FoundItem.status.in_(current))
+        .values(values)
+        .returning(FoundItem.id, FoundItem.title, FoundItem.description,
+                   FoundItem.location_found, FoundItem.date_found)
+        .execution_options(synchronize_session=False)).all()
+    notified = match_found_items(rows) if status == FoundItemStatus.PUBLISHED else 0
+    db.session.commit()
+    ids = [row.id for row in rows]
+    if status == FoundItemStatus.PUBLISHED:
+        similarity_index.update(ids)
+    else:
+        similarity_index.discard(ids)
+    if notified:
+        outbox.wake()
+    return ids
+
+
+@bp.app_template_global()
+def found_item_image_url(found_item, size=None):
+    if isinstance(found_item, ArchivedFoundItem):
+        version = found_item.image_version
+    elif size is None:
+        version = image_version(found_item)
+    else:
+        version = thumbnail_version(found_item)
+    if size is None:
+        return url_for('main.images', id=found_item.id, v=version)
+    return url_for('main.image_thumbnails', id=found_item.id, size=size, v=version)
+
+
+@bp.app_template_global()
+def found_item_image_srcset(found_item):
+    return ', '.join(f'{found_item_image_url(found_item, width)} {width}w'
+                     for width in current_app.config['THUMBNAIL_WIDTHS'])
+
+
+def send_image(path: Path | io.BytesIO, version: str, etag: str,
+               vary_accept: bool = False, mimetype: str | None = None):
+    # versioned URLs never change content, anything else must revalidate
+    immutable = request.args.get('v') == version
+    max_age = current_app.config['IMAGE_CACHE_MAX_AGE'] if immutable else None
+    if isinstance(path, Path):
+        if not path.is_file():
+            abort(404)
+        response = storage.send(path, etag=etag, max_age=max_age,
+                                immutable=immutable, mimetype=mimetype)
+    else:
+        response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                             max_age=max_age)
+        if immutable:
+            response.cache_control.immutable = True
+    if vary_accept:
+        response.vary.add('Accept')
+    return response
+
+
+@bp.route('/images/<int:id>')
+@query_budget(2)
 def images(id):
-    if current_app.static_folder is None:
-        return "Static folder not configured", 404
-    filepath = Path(current_app.static_folder,
-                    current_app.config['IMAGE_FOLDER'],
-                    id)
-    file = [f for f in filepath.iterdir() if f.is_file()][0]
-    return send_from_directory(filepath, file.name)
+    found_item = db.session.get(FoundItem, id)
+    if found_item is None:
+        return archived_image(id)
+    version = image_version(found_item)
+    if not found_item.image_filename or version is None:
+        abort(404)
+    return send_image(image_path(found_item),
+                      version, version)
 
 
-@bp.route('/images/<id>/thumb_<size>')
+@bp.route('/images/<int:id>/thumb_<size>')
+@query_budget(2)
 def image_thumbnails(id, size):
-    if current_app.static_folder is None:
-        return "Static folder not configured", 404
-    filepath = Path(current_app.static_folder,
-                    current_app.config['IMAGE_FOLDER'],
-                    id,
-                    f'thumb_{size}')
-    return send_from_directory(filepath, 'thumb.jpg')
+    found_item = db.session.get(FoundItem, id)
+    if found_item is None:
+        return archived_thumbnail(id, size)
+    version = thumbnail_version(found_item)
+    width = thumbnail_width(size)
+    if version is None or width is None:
+        abort(404)
+    fmt = negotiate_format(request.accept_mimetypes)
+    path = thumbnail_file(found_item, width, fmt)
+    if path is None:
+        abort(404)
+    return send_image(path, version, f'{version}-{width}-{fmt}', vary_accept=True)
+
+
+def archived_image(id: int):
+    # the original is read from the month's archive
+    archived_item = db.get_or_404(ArchivedFoundItem, id)
+    image = read_archived_image(archived_item)
+    if image is None or archived_item.image_version is None:
+        abort(404)
+    data, mimetype = image
+    return send_image(io.BytesIO(data), archived_item.image_version,
+                      archived_item.image_version, mimetype=mimetype)
+
+
+def archived_thumbnail(id: int, size: str):
+    # only the small thumbnail is kept, whatever size was asked for
+    archived_item = db.get_or_404(ArchivedFoundItem, id)
+    if archived_item.image_version is None or thumbnail_width(size) is None:
+        abort(404)
+    return send_image(archived_thumbnail_path(id), archived_item.image_version,
+                      f'{archived_item.image_version}-{ARCHIVE_THUMBNAIL}')
 
 
 @bp.route('/res/<path:filename>')
+@query_budget(0)
 def resources(filename):
     if current_app.static_folder is None:
         return "Static folder not configured", 404
-    filepath = Path(current_app.static_folder,
-                    current_app.config['RESOURCES_FOLDER'])
-    return send_from_directory(filepath, filename)
+    asset = assets.lookup(filename)
+    if asset is not None:
+        return send_asset(asset)
+    filepath = safe_join(str(Path(current_app.static_folder,
+                                  current_app.config['RESOURCES_FOLDER'])), filename)
+    if filepath is None or not Path(filepath).is_file():
+        abort(404)
+    return storage.send_static(Path(filepath))
     # flash(Path(filepath, filename).as_posix())
     # return redirect(url_for('main.index'))  # Placeholder to avoid broken links
+
+
+def send_asset(path: Path):
+    # fingerprinted names never change content; the preferred encoding the
+    # client accepts is sent as it was compressed at build time
+    for encoding, suffix in ENCODINGS:
+        compressed = path.with_name(path.name + suffix)
+        if request.accept_encodings[encoding] and compressed.is_file():
+            break
+    else:
+        encoding, compressed = None, path
+    response = storage.send_static(
+        compressed, etag=f'{path.name}-{encoding or "identity"}',
+        max_age=current_app.config['ASSET_CACHE_MAX_AGE'], immutable=True,
+        mimetype=mimetypes.guess_type(path.name)[0] or 'application/octet-stream')
+    if encoding is not None:
+        response.content_encoding = encoding
+    if compressible(path.name):
+        response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,142 @@
+import math
+import re
+from collections import defaultdict
+from typing import Iterable, Optional
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app, render_template
+from app import db
+from app.email import queue_email
+from app.models import LostItem, LostItemStatus, LostItemToken, LostItemMatch
+
+# Open lost reports are kept in an inverted index (lost_item_token) of
+# normalised tokens. Each report's token weights sum to one, so a found item
+# that shares every token of a report scores 1.0 before tokens that many
+# reports share are discounted. Publishing a found item only reads the
+# postings of its own tokens, so matching never scans the reports table.
+TOKEN_RE = re.compile(r'[^\W_]+')
+TOKEN_MAX_LENGTH = 40
+FIELD_WEIGHTS = (('title', 3.0), ('location', 2.0), ('description', 1.0))
+STOPWORDS = frozenset('''
+    a an and are as at be but by for from had has have i in is it its lost
+    my near no not of on or our so that the this to was we were with found
+'''.split())
+
+
+def normalize(word: str) -> str:
+    # just enough stemming for "keys" to match "key"
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text: Optional[str]) -> set[str]:
+    words = TOKEN_RE.findall((text or '').lower())
+    return {normalize(word)[:TOKEN_MAX_LENGTH] for word in words
+            if len(word) > 1 and word not in STOPWORDS}
+
+
+def token_weights(title: Optional[str], description: Optional[str],
+                  location: Optional[str]) -> dict[str, float]:
+    fields = {'title': title, 'description': description, 'location': location}
+    weights: dict[str, float] = defaultdict(float)
+    for field, weight in FIELD_WEIGHTS:
+        for token in tokenize(fields[field]):
+            weights[token] += weight
+    total = sum(weights.values())
+    return {token: weight / total for token, weight in weights.items()}
+
+
+def index_lost_item(lost_item: LostItem) -> None:
+    unindex_lost_item(lost_item)
+    weights = token_weights(lost_item.title, lost_item.description,
+                            lost_item.location_lost)
+    if weights:
+        db.session.execute(sa.insert(LostItemToken), [
+            {'token': token, 'lost_item_id': lost_item.id, 'weight': weight}
+            for token, weight in weights.items()])
+
+
+def unindex_lost_item(lost_item: LostItem) -> None:
+    db.session.execute(sa.delete(LostItemToken).where(
+        LostItemToken.lost_item_id == lost_item.id))
+
+
+def score_reports(postings: dict[str, list[tuple[int, float]]],
+                  tokens: set[str]) -> dict[int, float]:
+    # a token shared by many reports says little about any one of them
+    scores: dict[int, float] = defaultdict(float)
+    for token in tokens:
+        reports = postings.get(token, ())
+        for lost_item_id, weight in reports:
+            scores[lost_item_id] += weight / (1 + math.log(len(reports)))
+    return scores
+
+
+def match_found_items(found_items: Iterable[sa.Row]) -> int:
+    # found_items are rows with the id, title, description, location_found
+    # and date_found of newly published items; the caller commits
+    threshold = current_app.config['LOST_ITEM_MATCH_THRESHOLD']
+    limit = current_app.config['LOST_ITEM_MATCH_LIMIT']
+    items = {found_item.id: (found_item, tokenize(' '.join(filter(None, (
+        found_item.title, found_item.description, found_item.location_found)))))
+        for found_item in found_items}
+    all_tokens = set().union(*(tokens for _, tokens in items.values()))
+    if not all_tokens:
+        return 0
+
+    postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+    for token, lost_item_id, weight in db.session.execute(
+            sa.select(LostItemToken.token, LostItemToken.lost_item_id, LostItemToken.weight)
+            .where(LostItemToken.token.in_(all_tokens))):
+        postings[token].append((lost_item_id, weight))
+    candidates = {}
+    for found_item_id, (_, tokens) in items.items():
+        scores = score_reports(postings, tokens)
+        best = sorted((score, lost_item_id) for lost_item_id, score in scores.items()
+                      if score >= threshold)[::-1][:limit]
+        for score, lost_item_id in best:
+            candidates[lost_item_id, found_item_id] = score
+    if not candidates:
+        return 0
+
+    # candidates are checked in bulk: reports closed since they were indexed
+    # and pairs that were already notified are skipped
+    lost_items = {lost_item.id: lost_item for lost_item in db.session.scalars(
+        sa.select(LostItem)
+        .where(LostItem.id.in_({lost_item_id for lost_item_id, _ in candidates}),
+               LostItem.status == LostItemStatus.OPEN)
+        .options(so.joinedload(LostItem.owner)))}
+    notified = set(db.session.execute(
+        sa.select(LostItemMatch.lost_item_id, LostItemMatch.found_item_id)
+        .where(sa.tuple_(LostItemMatch.lost_item_id, LostItemMatch.found_item_id)
+               .in_(list(candidates)))).tuples())
+
+    matches = []
+    for (lost_item_id, found_item_id), score in candidates.items():
+        lost_item = lost_items.get(lost_item_id)
+        found_item = items[found_item_id][0]
+        if lost_item is None or (lost_item_id, found_item_id) in notified:
+            continue
+        if lost_item.date_lost and found_item.date_found and \
+                lost_item.date_lost > found_item.date_found:
+            continue
+        matches.append({'lost_item_id': lost_item_id, 'found_item_id': found_item_id,
+                        'score': score})
+        send_match_email(lost_item, found_item)
+    if matches:
+        db.session.execute(sa.insert(LostItemMatch), matches)
+    return len(matches)
+
+
+def send_match_email(lost_item: LostItem, found_item: sa.Row) -> None:
+    user = lost_item.owner
+    queue_email('[SMS Lost and Found] A Found Item May Be Yours',
+                sender=current_app.config['MAIL_FROMADDRESS'],
+                recipients=[user.email],
+                text_body=render_template('email/lost_item_match.txt', user=user,
+                                          lost_item=lost_item, found_item=found_item),
+                html_body=render_template('email/lost_item_match.html', user=user,
+                                          lost_item=lost_item, found_item=found_item))
@@ -0,0 +1,283 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable
+from flask import Flask, Response, abort, current_app, g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55)
+# files of other processes not refreshed for this long are from dead ones
+STALE_MIN_AGE = 30
+
+Labels = tuple[tuple[str, str], ...]
+
+HELP = {
+    'http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.'),
+    'http_request_duration_seconds': ('histogram', 'Time spent handling requests.'),
+    'db_queries_per_request': ('histogram', 'SQL statements executed per request.'),
+    'db_query_duration_seconds': ('histogram', 'Time spent in SQL statements.'),
+    'template_render_duration_seconds': ('histogram', 'Time spent rendering templates.'),
+    'image_job_duration_seconds': ('histogram',
+                                   'Time from submitting an image job to its completion.'),
+    'thumbnail_render_duration_seconds': ('histogram',
+                                          'Time spent rendering thumbnail variants.'),
+    'fragment_cache_requests_total': ('counter', 'Fragment cache lookups by result.'),
+    'page_cache_requests_total': ('counter', 'Anonymous page cache lookups by result.'),
+    'mail_outbox_pending': ('gauge', 'Messages waiting in the mail outbox.'),
+    'mail_outbox_sent': ('gauge', 'Delivered messages not yet purged from the mail outbox.'),
+    'mail_outbox_failed': ('gauge', 'Messages that ran out of delivery attempts.'),
+    'mail_outbox_oldest_pending_seconds': ('gauge', 'Age of the oldest pending message.'),
+}
+
+
+class Metrics:
+    # Counters and histograms are kept in memory and only touched under a
+    # lock on the hot path. With METRICS_DIR set, every process also writes
+    # its totals to a file there every METRICS_FLUSH_INTERVAL seconds, and
+    # /metrics adds up the files of all processes. A process removes its file
+    # when it exits; files that stop being refreshed, left by a process that
+    # was killed, are pruned by the next scrape. Prometheus sees the
+    # totals going down as a counter reset.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], list[float]] = {}
+        self._buckets: dict[str, tuple[float, ...]] = {}
+        self._gauges: list[Callable[[], dict[str, float]]] = []
+        self._lock = threading.Lock()
+        self._flusher_pid: int | None = None
+        self._process_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        import sqlalchemy as sa
+        from flask import before_render_template, template_rendered
+        self.app = app
+        app.extensions['metrics'] = self
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        sa.event.listen(sa.engine.Engine, 'before_cursor_execute', self._before_cursor_execute)
+        sa.event.listen(sa.engine.Engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        atexit.register(self.remove)
+
+    def inc(self, name: str, labels: dict[str, str], value: float = 1) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, labels: dict[str, str], value: float,
+                buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._buckets.setdefault(name, buckets)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0.0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def timer(self, name: str, **labels: str) -> '_Timer':
+        return _Timer(self, name, labels)
+
+    def gauge(self, fn: Callable[[], dict[str, float]]) -> None:
+        # gauges are computed when /metrics is scraped; every app the
+        # process creates registers them again
+        if fn not in self._gauges:
+            self._gauges.append(fn)
+
+    def _before_request(self) -> None:
+        g._metrics_start = time.perf_counter()
+        g._metrics_queries = 0
+        self._start_flusher()
+
+    def _after_request(self, response: Response) -> Response:
+        start = g.pop('_metrics_start', None)
+        if start is None:
+            return response
+        labels = {'endpoint': request.endpoint or 'none', 'method': request.method}
+        self.observe('http_request_duration_seconds', labels, time.perf_counter() - start)
+        self.observe('db_queries_per_request', labels, g.pop('_metrics_queries', 0),
+                     QUERY_COUNT_BUCKETS)
+        self.inc('http_requests_total', dict(labels, status=str(response.status_code)))
+        return response
+
+    def _before_render(self, sender, template, context, **extra) -> None:
+        g.setdefault('_metrics_templates', []).append(time.perf_counter())
+
+    def _after_render(self, sender, template, context, **extra) -> None:
+        starts = g.get('_metrics_templates')
+        if starts:
+            self.observe('template_render_duration_seconds',
+                         {'template': template.name or 'none'},
+                         time.perf_counter() - starts.pop())
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany) -> None:
+        conn.info.setdefault('_metrics_query_start', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany) -> None:
+        starts = conn.info.get('_metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        endpoint = 'none'
+        if has_request_context():
+            g._metrics_queries = g.get('_metrics_queries', 0) + 1
+            endpoint = request.endpoint or 'none'
+        self.observe('db_query_duration_seconds', {'endpoint': endpoint}, elapsed)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value]
+                             for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(values)]
+                               for (name, labels), values in self._histograms.items()],
+                'buckets': {name: list(b) for name, b in self._buckets.items()},
+            }
+
+    def metrics_dir(self) -> Path | None:
+        assert self.app is not None
+        directory = self.app.config['METRICS_DIR']
+        return Path(directory) if directory else None
+
+    def flush(self) -> None:
+        directory = self.metrics_dir()
+        if directory is None:
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        path = Path(directory, f'metrics-{self._process_id}.json')
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.snapshot()))
+        os.replace(tmp, path)
+
+    def remove(self) -> None:
+        directory = self.metrics_dir()
+        if directory is not None and self._flusher_pid == os.getpid():
+            Path(directory, f'metrics-{self._process_id}.json').unlink(missing_ok=True)
+
+    def _start_flusher(self) -> None:
+        if self._flusher_pid == os.getpid() or self.metrics_dir() is None:
+            return
+        self._flusher_pid = os.getpid()
+        self._process_id = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        assert self.app is not None
+        interval = self.app.config['METRICS_FLUSH_INTERVAL']
+
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        threading.Thread(target=run, name='metrics-flush', daemon=True).start()
+
+    def collect(self) -> list[dict]:
+        snapshots = [self.snapshot()]
+        directory = self.metrics_dir()
+        if directory is not None and directory.is_dir():
+            assert self.app is not None
+            own = f'metrics-{self._process_id}.json'
+            stale = time.time() - max(3 * self.app.config['METRICS_FLUSH_INTERVAL'],
+                                      STALE_MIN_AGE)
+            for path in directory.glob('metrics-*.json'):
+                if path.name == own:
+                    continue
+                try:
+                    if path.stat().st_mtime < stale:
+                        path.unlink(missing_ok=True)
+                        continue
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    pass
+        return snapshots
+
+    def render(self) -> str:
+        counters: dict[tuple[str, Labels], float] = {}
+        histograms: dict[tuple[str, Labels], list[float]] = {}
+        buckets: dict[str, tuple[float, ...]] = {}
+        for snapshot in self.collect():
+            buckets.update({name: tuple(b) for name, b in snapshot['buckets'].items()})
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.setdefault(key, [0.0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+
+        lines: list[str] = []
+        described: set[str] = set()
+
+        def describe(name: str, type: str) -> None:
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {HELP.get(name, (type, name))[1]}')
+                lines.append(f'# TYPE {name} {type}')
+
+        for (name, labels), value in sorted(counters.items()):
+            describe(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), values in sorted(histograms.items()):
+            describe(name, 'histogram')
+            cumulative = 0.0
+            for bound, count in zip(buckets[name], values):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", f"{bound:g}"),))} '
+                             f'{cumulative:g}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} '
+                         f'{values[-1]:g}')
+            lines.append(f'{name}_sum{format_labels(labels)} {values[-2]:g}')
+            lines.append(f'{name}_count{format_labels(labels)} {values[-1]:g}')
+        for fn in self._gauges:
+            for name, value in fn().items():
+                describe(name, 'gauge')
+                lines.append(f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def view(self) -> Response:
+        token = current_app.config['METRICS_TOKEN']
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            abort(403)
+        return Response(self.render(), mimetype='text/plain',
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class _Timer:
+    def __init__(self, metrics: Metrics, name: str, labels: dict[str, str]) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.name, self.labels, time.perf_counter() - self.start)
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels) + '}'
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
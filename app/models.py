@@ -8,7 +8,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 from enum import Enum
 from time import time
-from app import db, login
+from app import db, login, user_cache
 
 
 class UserStatus(Enum):
@@ -28,9 +28,13 @@ class User(UserMixin, db.Model):
     status: so.Mapped[UserStatus] = so.mapped_column(
         sa.Enum(UserStatus, native_enum=False, validate_strings=True),
         default=UserStatus.PENDING)
+    auth_version: so.Mapped[int] = so.mapped_column(
+        sa.Integer, default=0, server_default='0')
 
     found_items: so.WriteOnlyMapped['FoundItem'] = so.relationship(
         back_populates='reporter', cascade='all, delete-orphan')
+    lost_items: so.WriteOnlyMapped['LostItem'] = so.relationship(
+        back_populates='owner', cascade='all, delete-orphan')
 
     __table_args__ = (
         sa.CheckConstraint(
@@ -72,13 +76,36 @@ class User(UserMixin, db.Model):
 
 @login.user_loader
 def load_user(id):
-    return db.session.get(User, int(id))
+    return user_cache.get(int(id))
+
+
+class ImageBlob(db.Model):
+    sha256: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    format: so.Mapped[str] = so.mapped_column(sa.String(10))
+    size: so.Mapped[int] = so.mapped_column(sa.Integer)
+    width: so.Mapped[int] = so.mapped_column(sa.Integer)
+    height: so.Mapped[int] = so.mapped_column(sa.Integer)
+    ref_count: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+    ready: so.Mapped[bool] = so.mapped_column(sa.Boolean, default=False)
+    # 64-bit difference hash of the image, stored as a signed integer
+    phash: so.Mapped[Optional[int]] = so.mapped_column(sa.BigInteger)
+    created: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self) -> str:
+        return f'<ImageBlob {self.sha256[:16]} refs={self.ref_count}>'
 
 
 class FoundItemStatus(Enum):
     REVIEW = 'review'
     PUBLISHED = 'published'
     CLOSED = 'closed'
+    REJECTED = 'rejected'
+
+
+# statuses shown in listings and search; rejected items are hidden
+LISTED_STATUSES = (FoundItemStatus.REVIEW, FoundItemStatus.PUBLISHED,
+                   FoundItemStatus.CLOSED)
 
 
 class FoundItem(db.Model):
@@ -89,19 +116,175 @@ class FoundItem(db.Model):
         default=lambda: datetime.now(timezone.utc))
     location_found: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
     image_filename: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
+    image_sha256: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(64), sa.ForeignKey('image_blob.sha256'), index=True)
+    image_processing: so.Mapped[bool] = so.mapped_column(
+        sa.Boolean, default=False, server_default=sa.false())
     user_id: so.Mapped[int] = so.mapped_column(
         sa.Integer, sa.ForeignKey('user.id'))
     status: so.Mapped[FoundItemStatus] = so.mapped_column(
         sa.Enum(FoundItemStatus, native_enum=False, validate_strings=True),
         default=FoundItemStatus.REVIEW)
+    revision: so.Mapped[int] = so.mapped_column(
+        sa.Integer, default=0, server_default='0')
+    updated: so.Mapped[Optional[datetime]] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc))
+    # when the item was first published; items that never were stay out of
+    # the public changes feed
+    published: so.Mapped[Optional[datetime]] = so.mapped_column()
 
     reporter: so.Mapped[User] = so.relationship(back_populates='found_items')
 
     __table_args__ = (
         sa.CheckConstraint(
-            "status IN ('REVIEW', 'PUBLISHED', 'CLOSED')",
+            "status IN ('REVIEW', 'PUBLISHED', 'CLOSED', 'REJECTED')",
             name='check_found_item_status'),
+        sa.Index('ix_found_item_status_date_found_id', 'status', 'date_found', 'id'),
+        sa.Index('ix_found_item_updated_id', 'updated', 'id'),
     )
 
     def __repr__(self) -> str:
         return f'<FoundItem {self.title} by User {self.user_id}>'
+
+    def bump_revision(self) -> None:
+        # invalidates cached renderings of the item
+        self.revision = (self.revision or 0) + 1
+
+
+class ImageJob(db.Model):
+    # an upload waiting in its staging directory for thumbnails; the row
+    # outlives the worker that was given the job, so jobs lost to a crash
+    # or restart can be requeued by `flask images recover`
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    found_item_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('found_item.id', ondelete='CASCADE'), index=True)
+    sha256: so.Mapped[str] = so.mapped_column(
+        sa.String(64), sa.ForeignKey('image_blob.sha256'), index=True)
+    format: so.Mapped[str] = so.mapped_column(sa.String(10))
+    # the staged original, relative to the blob store
+    path: so.Mapped[str] = so.mapped_column(sa.String(255))
+    created: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self) -> str:
+        return f'<ImageJob {self.id} for FoundItem {self.found_item_id}>'
+
+
+class ArchivedFoundItem(db.Model):
+    # closed found items moved out of found_item by app.archive; the
+    # original image lives in a per-month archive, only a small thumbnail
+    # stays in the static folder
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=False)
+    title: so.Mapped[str] = so.mapped_column(sa.String(140))
+    description: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    date_found: so.Mapped[Optional[datetime]] = so.mapped_column()
+    location_found: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
+    user_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, sa.ForeignKey('user.id'), index=True)
+    status: so.Mapped[FoundItemStatus] = so.mapped_column(
+        sa.Enum(FoundItemStatus, native_enum=False, validate_strings=True))
+    image_filename: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
+    image_version: so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+    image_archive: so.Mapped[Optional[str]] = so.mapped_column(sa.String(64))
+    archived: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    reporter: so.Mapped[User] = so.relationship()
+
+    __table_args__ = (
+        sa.CheckConstraint(
+            "status IN ('REVIEW', 'PUBLISHED', 'CLOSED', 'REJECTED')",
+            name='check_archived_found_item_status'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<ArchivedFoundItem {self.title} by User {self.user_id}>'
+
+
+class LostItemStatus(Enum):
+    OPEN = 'open'
+    CLOSED = 'closed'
+
+
+class LostItem(db.Model):
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    title: so.Mapped[str] = so.mapped_column(sa.String(140))
+    description: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    date_lost: so.Mapped[Optional[datetime]] = so.mapped_column()
+    location_lost: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
+    user_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, sa.ForeignKey('user.id'), index=True)
+    status: so.Mapped[LostItemStatus] = so.mapped_column(
+        sa.Enum(LostItemStatus, native_enum=False, validate_strings=True),
+        default=LostItemStatus.OPEN)
+    created: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    owner: so.Mapped[User] = so.relationship(back_populates='lost_items')
+
+    __table_args__ = (
+        sa.CheckConstraint(
+            "status IN ('OPEN', 'CLOSED')",
+            name='check_lost_item_status'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<LostItem {self.title} by User {self.user_id}>'
+
+
+class LostItemToken(db.Model):
+    # inverted index of open lost reports, maintained by app.matching
+    token: so.Mapped[str] = so.mapped_column(sa.String(40), primary_key=True)
+    lost_item_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('lost_item.id', ondelete='CASCADE'), primary_key=True, index=True)
+    weight: so.Mapped[float] = so.mapped_column(sa.Float)
+
+
+class LostItemMatch(db.Model):
+    lost_item_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('lost_item.id', ondelete='CASCADE'), primary_key=True)
+    found_item_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('found_item.id', ondelete='CASCADE'), primary_key=True)
+    score: so.Mapped[float] = so.mapped_column(sa.Float)
+    created: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+
+    found_item: so.Mapped['FoundItem'] = so.relationship()
+
+
+class OutboxStatus(Enum):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+
+
+class OutboxMessage(db.Model):
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    subject: so.Mapped[str] = so.mapped_column(sa.String(255))
+    sender: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+    recipients: so.Mapped[list[str]] = so.mapped_column(sa.JSON)
+    text_body: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    html_body: so.Mapped[Optional[str]] = so.mapped_column(sa.Text)
+    status: so.Mapped[OutboxStatus] = so.mapped_column(
+        sa.Enum(OutboxStatus, native_enum=False, validate_strings=True),
+        default=OutboxStatus.PENDING)
+    attempts: so.Mapped[int] = so.mapped_column(sa.Integer, default=0)
+    last_error: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+    created: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+    next_attempt: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
+    sent: so.Mapped[Optional[datetime]] = so.mapped_column()
+    claim: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32), index=True)
+    claimed_until: so.Mapped[Optional[datetime]] = so.mapped_column()
+
+    __table_args__ = (
+        sa.CheckConstraint(
+            "status IN ('PENDING', 'SENT', 'FAILED')",
+            name='check_outbox_message_status'),
+        sa.Index('ix_outbox_message_status_next_attempt', 'status', 'next_attempt'),
+    )
+
+    def __repr__(self) -> str:
+        return f'<OutboxMessage {self.id} {self.status.name}>'
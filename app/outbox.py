@@ -0,0 +1,180 @@
+import atexit
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+
+PURGE_INTERVAL = 3600
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class MailOutbox:
+    # Outgoing mail is written to the outbox_message table and delivered by a
+    # fixed pool of MAIL_WORKERS threads per process. Each worker claims a
+    # batch of due messages, sends the whole batch over one SMTP connection
+    # and reschedules failures with exponential backoff, so messages survive
+    # restarts and bursts never create more threads or connections. Idle
+    # workers purge delivered messages after MAIL_SENT_RETENTION_DAYS.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pid: int | None = None
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        app.extensions['outbox'] = self
+        app.before_request(self.start)
+        atexit.register(self.stop)
+
+    def wake(self) -> None:
+        self.start()
+        self._wake.set()
+
+    def start(self) -> None:
+        assert self.app is not None
+        with self._lock:
+            if self._pid == os.getpid() or self.app.config['MAIL_WORKERS'] <= 0:
+                return
+            self._pid = os.getpid()
+        for i in range(self.app.config['MAIL_WORKERS']):
+            threading.Thread(target=self._run, name=f'mail-worker-{i}',
+                             daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self) -> None:
+        assert self.app is not None
+        interval = self.app.config['MAIL_POLL_INTERVAL']
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    sent = self.deliver()
+                    if not sent and time.monotonic() >= self._next_purge:
+                        self._next_purge = time.monotonic() + PURGE_INTERVAL
+                        self.purge()
+            except Exception:
+                self.app.logger.exception('Mail delivery failed')
+                sent = 0
+            if not sent:
+                self._wake.wait(interval)
+                self._wake.clear()
+
+    def claim(self) -> list:
+        import sqlalchemy as sa
+        from app import db
+        from app.models import OutboxMessage, OutboxStatus
+        assert self.app is not None
+        now = utcnow()
+        token = uuid.uuid4().hex
+        due = sa.select(OutboxMessage.id) \
+            .where(OutboxMessage.status == OutboxStatus.PENDING,
+                   OutboxMessage.next_attempt <= now,
+                   sa.or_(OutboxMessage.claimed_until.is_(None),
+                          OutboxMessage.claimed_until < now)) \
+            .order_by(OutboxMessage.next_attempt) \
+            .limit(self.app.config['MAIL_BATCH_SIZE'])
+        db.session.execute(
+            sa.update(OutboxMessage)
+            .where(OutboxMessage.id.in_(due.scalar_subquery()),
+                   sa.or_(OutboxMessage.claimed_until.is_(None),
+                          OutboxMessage.claimed_until < now))
+            .values(claim=token,
+                    claimed_until=now + timedelta(
+                        seconds=self.app.config['MAIL_CLAIM_TIMEOUT']))
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return list(db.session.scalars(
+            sa.select(OutboxMessage).where(OutboxMessage.claim == token)))
+
+    def deliver(self) -> int:
+        from flask_mail import Message
+        from app import db, mail
+        from app.models import OutboxStatus
+        messages = self.claim()
+        if not messages:
+            return 0
+        sent = 0
+        try:
+            with mail.connect() as connection:
+                for message in messages:
+                    try:
+                        connection.send(Message(
+                            message.subject, sender=message.sender,
+                            recipients=message.recipients,
+                            body=message.text_body, html=message.html_body))
+                    except Exception as e:
+                        self._retry(message, e)
+                    else:
+                        message.status = OutboxStatus.SENT
+                        message.sent = utcnow()
+                        sent += 1
+                    message.attempts += 1
+                    message.claim = None
+                    message.claimed_until = None
+        except Exception as e:
+            # the connection itself failed, every unsent message is retried
+            for message in messages:
+                if message.claim is not None:
+                    self._retry(message, e)
+                    message.attempts += 1
+                    message.claim = None
+                    message.claimed_until = None
+        db.session.commit()
+        return len(messages)
+
+    def _retry(self, message, error: Exception) -> None:
+        from app.models import OutboxStatus
+        assert self.app is not None
+        message.last_error = str(error)[:255]
+        if message.attempts + 1 >= self.app.config['MAIL_MAX_ATTEMPTS']:
+            message.status = OutboxStatus.FAILED
+            self.app.logger.error(f'Giving up on mail {message.id}: {error}')
+        else:
+            delay = self.app.config['MAIL_RETRY_DELAY'] * 2 ** message.attempts
+            message.next_attempt = utcnow() + timedelta(seconds=delay)
+
+    def purge(self) -> int:
+        """Delete messages delivered more than MAIL_SENT_RETENTION_DAYS ago
+        and return how many were deleted."""
+        import sqlalchemy as sa
+        from app import db
+        from app.models import OutboxMessage, OutboxStatus
+        assert self.app is not None
+        before = utcnow() - timedelta(days=self.app.config['MAIL_SENT_RETENTION_DAYS'])
+        result = db.session.execute(
+            sa.delete(OutboxMessage)
+            .where(OutboxMessage.status == OutboxStatus.SENT, OutboxMessage.sent < before)
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        return result.rowcount
+
+    def stats(self) -> dict[str, float]:
+        import sqlalchemy as sa
+        from app import db
+        from app.models import OutboxMessage, OutboxStatus
+        counts = dict(db.session.execute(
+            sa.select(OutboxMessage.status, sa.func.count())
+            .group_by(OutboxMessage.status)).all())
+        oldest = db.session.scalar(
+            sa.select(sa.func.min(OutboxMessage.created))
+            .where(OutboxMessage.status == OutboxStatus.PENDING))
+        stats: dict[str, float] = {f'{status.value}': counts.get(status, 0)
+                                   for status in OutboxStatus}
+        stats['oldest_pending_seconds'] = \
+            (utcnow() - oldest).total_seconds() if oldest else 0
+        return stats
+
+    def metrics(self) -> dict[str, float]:
+        return {f'mail_outbox_{name}': value for name, value in self.stats().items()}
@@ -0,0 +1,200 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, NamedTuple
+from flask import Flask, Response, current_app, make_response, request, session
+from flask_login import current_user
+
+CONTENT_ATTRIBUTES = ('title', 'description', 'date_found', 'location_found',
+                      'image_filename', 'image_sha256', 'image_processing', 'status',
+                      'revision')
+
+
+class CachedPage(NamedTuple):
+    body: bytes
+    status: int
+    headers: list[tuple[str, str]]
+    etag: str
+    generation: int
+    stored: float
+
+
+class PageCache:
+    # Whole-response cache for anonymous GETs of the views decorated with
+    # @cache_page, keyed by path and query string. Commits that touch found
+    # items bump a generation stamp (the mtime of an epoch file, shared by
+    # all worker processes) and entries from older generations are stale.
+    # A stale entry younger than PAGE_CACHE_STALE seconds is still served
+    # while one request per key renders the replacement.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.max_size = 0
+        self.ttl = 0
+        self.stale = 0
+        self.epoch_file = ''
+        self._entries: OrderedDict[str, CachedPage] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        import sqlalchemy as sa
+        from app import db
+        self.app = app
+        self.max_size = app.config['PAGE_CACHE_SIZE']
+        self.ttl = app.config['PAGE_CACHE_TTL']
+        self.stale = app.config['PAGE_CACHE_STALE']
+        self.epoch_file = os.path.join(app.instance_path, 'page_cache.epoch')
+        app.extensions['page_cache'] = self
+        if not sa.event.contains(db.session, 'before_flush', self._before_flush):
+            sa.event.listen(db.session, 'before_flush', self._before_flush)
+            sa.event.listen(db.session, 'do_orm_execute', self._do_orm_execute)
+            sa.event.listen(db.session, 'after_commit', self._after_commit)
+            sa.event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def generation(self) -> int:
+        try:
+            return os.stat(self.epoch_file).st_mtime_ns
+        except OSError:
+            return 0
+
+    def invalidate(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.epoch_file), exist_ok=True)
+            with open(self.epoch_file, 'a'):
+                pass
+            os.utime(self.epoch_file)
+        except OSError:
+            if self.app is not None:
+                self.app.logger.exception('Could not update the page cache epoch')
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def get(self, key: str) -> CachedPage | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key: str, response: Response, generation: int) -> CachedPage:
+        body = response.get_data()
+        entry = CachedPage(
+            body=body,
+            status=response.status_code,
+            headers=[(k, v) for k, v in response.headers.items()
+                     if k not in ('Content-Length', 'ETag', 'Cache-Control', 'Vary')],
+            etag=hashlib.sha1(body).hexdigest(),
+            generation=generation,
+            stored=time.time())
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def claim(self, key: str) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def release(self, key: str) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def respond(self, entry: CachedPage) -> Response:
+        response = Response(entry.body, status=entry.status, headers=entry.headers)
+        self.add_headers(response, public=True)
+        response.set_etag(entry.etag)
+        return response.make_conditional(request)
+
+    def add_headers(self, response: Response, public: bool) -> None:
+        # the page differs for signed-in users, who always carry a cookie
+        response.vary.add('Cookie')
+        if public:
+            response.cache_control.public = True
+            response.cache_control.max_age = self.ttl
+            response.cache_control.stale_while_revalidate = self.stale
+        else:
+            response.cache_control.private = True
+
+    def _before_flush(self, session, flush_context, instances) -> None:
+        import sqlalchemy as sa
+        from app.models import FoundItem
+        if session.info.get('page_cache_invalidate'):
+            return
+        for obj in session.new | session.deleted:
+            if isinstance(obj, FoundItem):
+                session.info['page_cache_invalidate'] = True
+                return
+        for obj in session.dirty:
+            if not isinstance(obj, FoundItem):
+                continue
+            state = sa.inspect(obj)
+            if any(state.attrs[key].history.has_changes() for key in CONTENT_ATTRIBUTES):
+                session.info['page_cache_invalidate'] = True
+                return
+
+    def _do_orm_execute(self, orm_execute_state) -> None:
+        # bulk INSERT, UPDATE and DELETE statements bypass the flush
+        from app.models import FoundItem
+        state = orm_execute_state
+        if (state.is_insert or state.is_update or state.is_delete) and \
+                any(mapper.class_ is FoundItem for mapper in state.all_mappers):
+            state.session.info['page_cache_invalidate'] = True
+
+    def _after_commit(self, session) -> None:
+        if session.info.pop('page_cache_invalidate', None):
+            self.invalidate()
+
+    def _after_rollback(self, session) -> None:
+        session.info.pop('page_cache_invalidate', None)
+
+
+def cache_page(view: Callable) -> Callable:
+    @functools.wraps(view)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        from app import metrics
+        cache: PageCache = current_app.extensions['page_cache']
+        if not cache.enabled or request.method != 'GET':
+            return view(*args, **kwargs)
+        if current_user.is_authenticated or '_flashes' in session:
+            response = make_response(view(*args, **kwargs))
+            cache.add_headers(response, public=False)
+            return response
+        key = request.full_path
+        generation = cache.generation()
+        entry = cache.get(key)
+        now = time.time()
+        if entry is not None and entry.generation == generation \
+                and now - entry.stored < cache.ttl:
+            metrics.inc('page_cache_requests_total', {'result': 'hit'})
+            return cache.respond(entry)
+        if not cache.claim(key):
+            if entry is not None and now - entry.stored < cache.ttl + cache.stale:
+                metrics.inc('page_cache_requests_total', {'result': 'stale'})
+                return cache.respond(entry)
+            return view(*args, **kwargs)
+        metrics.inc('page_cache_requests_total', {'result': 'miss'})
+        try:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or session.modified \
+                    or response.direct_passthrough:
+                return response
+            return cache.respond(cache.store(key, response, generation))
+        finally:
+            cache.release(key)
+    return wrapper
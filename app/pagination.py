@@ -0,0 +1,153 @@
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+import sqlalchemy as sa
+from app import db
+from app.models import FoundItem, FoundItemStatus, LISTED_STATUSES
+
+
+class KeysetPage:
+    def __init__(self, items: list[FoundItem], next_cursor: Optional[str],
+                 prev_cursor: Optional[str]) -> None:
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self) -> bool:
+        return self.prev_cursor is not None
+
+
+def _serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                             salt='found-item-cursor')
+
+
+def encode_cursor(found_item: FoundItem, direction: str) -> str:
+    date_found = found_item.date_found.isoformat() if found_item.date_found else None
+    return str(_serializer().dumps([direction, date_found, found_item.id]))
+
+
+def decode_cursor(cursor: Optional[str]) -> tuple[str, Optional[tuple[Optional[datetime], int]]]:
+    if not cursor:
+        return 'next', None
+    try:
+        direction, date_found, id = _serializer().loads(cursor)
+        if direction not in ('next', 'prev'):
+            raise ValueError(cursor)
+        return direction, (datetime.fromisoformat(date_found)
+                           if date_found is not None else None, int(id))
+    except (BadSignature, ValueError, TypeError):
+        return 'next', None
+
+
+def keyset_ranges(key: Optional[tuple[Optional[datetime], int]], forward: bool) -> list:
+    # Items without a date_found come after all dated ones, ordered by id.
+    # Dated and undated items are separate ranges of the index, so each is
+    # read on its own; returns the (condition, order) of each range to read.
+    dated, undated = FoundItem.date_found.is_not(None), FoundItem.date_found.is_(None)
+    if forward:
+        dated_order = (FoundItem.date_found.desc(), FoundItem.id.desc())
+        undated_order = (FoundItem.id.desc(),)
+    else:
+        dated_order = (FoundItem.date_found.asc(), FoundItem.id.asc())
+        undated_order = (FoundItem.id.asc(),)
+    if key is None:
+        return [(dated, dated_order), (undated, undated_order)]
+    date_found, id = key
+    if date_found is None:
+        if forward:
+            return [(sa.and_(undated, FoundItem.id < id), undated_order)]
+        return [(dated, dated_order), (sa.and_(undated, FoundItem.id > id), undated_order)]
+    sort_key = sa.tuple_(FoundItem.date_found, FoundItem.id)
+    if forward:
+        return [(sort_key < (date_found, id), dated_order), (undated, undated_order)]
+    return [(sort_key > (date_found, id), dated_order)]
+
+
+def paginate_found_items(cursor: Optional[str], per_page: int,
+                         statuses: Iterable[FoundItemStatus] = LISTED_STATUSES,
+                         ) -> KeysetPage:
+    # Newest first, keyed on (date_found, id). Each status is read as its own
+    # range of the (status, date_found, id) index and the per-status pages are
+    # merged, so a page costs per_page + 1 rows per status however deep it is.
+    direction, key = decode_cursor(cursor)
+    forward = direction == 'next'
+    ranges = keyset_ranges(key, forward)
+    items: list[FoundItem] = []
+    for status in statuses:
+        queries = [sa.select(FoundItem).where(FoundItem.status == status, condition)
+                   .order_by(*order).limit(per_page + 1) for condition, order in ranges]
+        if len(queries) > 1:
+            # one statement per status all the same
+            union = sa.union_all(*(sa.select(query.subquery()) for query in queries))
+            query = sa.select(FoundItem).from_statement(union)
+        else:
+            query = queries[0]
+        items.extend(db.session.scalars(query))
+
+    items.sort(key=lambda i: (i.date_found is not None, i.date_found or datetime.min, i.id),
+               reverse=forward)
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if not forward:
+        items.reverse()
+    if not items:
+        if not forward:
+            return paginate_found_items(None, per_page, statuses)
+        return KeysetPage(items, None, None)
+
+    has_next = has_more if forward else True
+    has_prev = key is not None if forward else has_more
+    return KeysetPage(
+        items,
+        encode_cursor(items[-1], 'next') if has_next else None,
+        encode_cursor(items[0], 'prev') if has_prev else None)
+
+
+def _changes_serializer() -> URLSafeSerializer:
+    return URLSafeSerializer(current_app.config['SECRET_KEY'],
+                             salt='found-item-changes')
+
+
+def encode_since(found_item: FoundItem) -> str:
+    updated = found_item.updated.isoformat() if found_item.updated else None
+    return str(_changes_serializer().dumps([updated, found_item.id]))
+
+
+def decode_since(token: str) -> tuple[datetime, int]:
+    # raises ValueError for tokens that were not issued by encode_since
+    try:
+        updated, id = _changes_serializer().loads(token)
+        return datetime.fromisoformat(updated), int(id)
+    except (BadSignature, TypeError) as e:
+        raise ValueError(token) from e
+
+
+def found_item_changes(since: Optional[tuple[datetime, int]], limit: int,
+                       settle: float = 0) -> tuple[list[FoundItem], bool]:
+    # Oldest change first, keyed on (updated, id). Changes from the last
+    # `settle` seconds are held back so a transaction that commits late with
+    # an earlier timestamp is not skipped by a client that already moved on.
+    # items that were never published are not public, not even their ids
+    query = sa.select(FoundItem).where(FoundItem.updated.is_not(None),
+                                       FoundItem.published.is_not(None))
+    if since is not None:
+        query = query.where(sa.tuple_(FoundItem.updated, FoundItem.id) > since)
+    if settle:
+        horizon = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=settle)
+        query = query.where(FoundItem.updated <= horizon)
+    query = query.order_by(FoundItem.updated.asc(), FoundItem.id.asc())
+    items = list(db.session.scalars(query.limit(limit + 1)))
+    return items[:limit], len(items) > limit
@@ -0,0 +1,104 @@
+import functools
+from collections import Counter
+from typing import Any, Callable
+from flask import Flask, Response, current_app, g, has_request_context, request
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryMonitor:
+    # Development and testing aid: records every statement a request runs,
+    # logs statements repeated with different parameters (the usual sign of
+    # a lazy load inside a loop) and enforces the budgets declared with
+    # @query_budget. Disabled unless QUERY_MONITOR is set or the app runs in
+    # debug or testing mode. Budgets fail the request only when testing or
+    # with QUERY_MONITOR='strict'; otherwise overruns are logged.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.enabled = False
+        self.strict = False
+        self.repeat_threshold = 3
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        import sqlalchemy as sa
+        self.app = app
+        self.enabled = bool(app.config['QUERY_MONITOR']) or app.debug or app.testing
+        self.strict = app.config['QUERY_MONITOR'] == 'strict' or app.testing
+        self.repeat_threshold = app.config['QUERY_REPEAT_THRESHOLD']
+        app.extensions['query_monitor'] = self
+        if not self.enabled:
+            return
+        app.after_request(self._after_request)
+        if not sa.event.contains(sa.engine.Engine, 'before_cursor_execute', _record):
+            sa.event.listen(sa.engine.Engine, 'before_cursor_execute', _record)
+
+    def _after_request(self, response: Response) -> Response:
+        statements: Counter[str] | None = g.pop('_query_monitor', None)
+        if not statements:
+            return response
+        response.headers['X-Query-Count'] = str(statements.total())
+        threshold = max(self.repeat_threshold, g.pop('_query_repeats', 0) + 1)
+        for statement, count in statements.items():
+            if count >= threshold:
+                current_app.logger.warning(
+                    'Possible N+1 in %s: statement ran %d times: %s',
+                    request.endpoint, count, ' '.join(statement.split()))
+        return response
+
+
+def _record(conn, cursor, statement, parameters, context, executemany) -> None:
+    if not has_request_context():
+        return
+    monitor = current_app.extensions.get('query_monitor')
+    if monitor is None or not monitor.enabled:
+        return
+    if '_query_monitor' not in g:
+        g._query_monitor = Counter()
+    # parameters are bound separately, so identical text means the
+    # statements differ in parameters only
+    g._query_monitor[statement] += 1
+    # strict budgets stop the view before the statement over budget runs,
+    # so it cannot commit anything afterwards
+    budget = g.get('_query_budget')
+    if budget is not None and monitor.strict:
+        limit, before = budget
+        used = g._query_monitor.total() - before
+        if used > limit:
+            raise QueryBudgetExceeded(
+                f'{request.endpoint} ran {used} statements, budget is {limit}')
+
+
+def statement_count() -> int:
+    statements: Counter[str] | None = g.get('_query_monitor')
+    return statements.total() if statements else 0
+
+
+def query_budget(limit: int, repeats: int = 0) -> Callable:
+    """Limit a view to `limit` statements, including the statements issued
+    while rendering its template. In strict mode the statement over budget
+    raises QueryBudgetExceeded, otherwise the overrun is logged. `repeats`
+    declares how often the view legitimately runs the same statement."""
+    def decorator(view: Callable) -> Callable:
+        @functools.wraps(view)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            monitor = current_app.extensions.get('query_monitor')
+            if monitor is None or not monitor.enabled:
+                return view(*args, **kwargs)
+            g._query_repeats = repeats
+            before = statement_count()
+            g._query_budget = (limit, before)
+            try:
+                response = view(*args, **kwargs)
+            finally:
+                g.pop('_query_budget', None)
+            used = statement_count() - before
+            if used > limit:
+                current_app.logger.warning(
+                    '%s ran %d statements, budget is %d', request.endpoint, used, limit)
+            return response
+        return wrapper
+    return decorator
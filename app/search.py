@@ -0,0 +1,78 @@
+import re
+import sqlalchemy as sa
+from app import db
+from app.models import FoundItem, LISTED_STATUSES
+
+# SQLite keeps an external-content FTS5 index in sync with found_item through
+# triggers; PostgreSQL uses a GIN index over the same document expression.
+FTS_TABLE = 'found_item_fts'
+FTS_WEIGHTS = (10.0, 1.0, 5.0)
+SQLITE_SEARCH_DDL = [
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5("
+    "title, description, location_found, "
+    "content='found_item', content_rowid='id', tokenize='porter unicode61')",
+    f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON found_item BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, description, location_found) "
+    "VALUES (new.id, new.title, new.description, new.location_found); END",
+    f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON found_item BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, location_found) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location_found); END",
+    f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF title, description, location_found "
+    f"ON found_item BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, location_found) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location_found); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, description, location_found) "
+    "VALUES (new.id, new.title, new.description, new.location_found); END",
+]
+SEARCH_DOCUMENT = ("to_tsvector('english', coalesce(title, '') || ' ' || "
+                   "coalesce(description, '') || ' ' || coalesce(location_found, ''))")
+POSTGRESQL_SEARCH_DDL = [
+    f"CREATE INDEX ix_found_item_search ON found_item USING gin (({SEARCH_DOCUMENT}))",
+]
+
+for statement in SQLITE_SEARCH_DDL:
+    sa.event.listen(FoundItem.__table__, 'after_create',
+                    sa.DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRESQL_SEARCH_DDL:
+    sa.event.listen(FoundItem.__table__, 'after_create',
+                    sa.DDL(statement).execute_if(dialect='postgresql'))
+sa.event.listen(FoundItem.__table__, 'before_drop',
+                sa.DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+
+def fts_query(text: str) -> str:
+    # quote every word so user input can never be parsed as FTS5 syntax, and
+    # allow prefix matches on each of them
+    return ' '.join(f'"{token}"*' for token in re.findall(r'\w+', text))
+
+
+def search_found_items(text: str, page: int,
+                       per_page: int) -> tuple[list[FoundItem], bool]:
+    dialect = db.session.get_bind().dialect.name
+    query = sa.select(FoundItem).where(FoundItem.status.in_(LISTED_STATUSES))
+    if dialect == 'sqlite':
+        match = fts_query(text)
+        if not match:
+            return [], False
+        fts = sa.table(FTS_TABLE, sa.column('rowid'))
+        fts_column = sa.literal_column(FTS_TABLE)
+        query = query.join(fts, fts.c.rowid == FoundItem.id) \
+            .where(fts_column.op('MATCH')(match)) \
+            .order_by(sa.func.bm25(fts_column, *FTS_WEIGHTS))
+    elif dialect == 'postgresql':
+        document = sa.literal_column(SEARCH_DOCUMENT)
+        ts_query = sa.func.websearch_to_tsquery(sa.literal_column("'english'"), text)
+        query = query.where(document.op('@@')(ts_query)) \
+            .order_by(sa.func.ts_rank(document, ts_query).desc())
+    else:
+        for token in re.findall(r'\w+', text):
+            pattern = f'%{token}%'
+            query = query.where(sa.or_(FoundItem.title.ilike(pattern),
+                                       FoundItem.description.ilike(pattern),
+                                       FoundItem.location_found.ilike(pattern)))
+        query = query.order_by(FoundItem.date_found.desc())
+    query = query.order_by(FoundItem.id.desc()) \
+        .offset((page - 1) * per_page).limit(per_page + 1)
+    found_items = list(db.session.scalars(query))
+    return found_items[:per_page], len(found_items) > per_page
+
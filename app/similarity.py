@@ -0,0 +1,139 @@
+import threading
+import time
+from typing import Iterable
+from flask import Flask
+
+
+class BKTree:
+    # Burkhard-Keller tree over 64-bit hashes with Hamming distance. Each
+    # node keeps the keys of every item with exactly its hash; children are
+    # indexed by their distance to the node, which lets a search skip every
+    # subtree that the triangle inequality rules out.
+    def __init__(self) -> None:
+        self.root: list | None = None  # [hash, keys, children]
+        self.size = 0
+
+    def add(self, hash: int, key) -> None:
+        self.size += 1
+        if self.root is None:
+            self.root = [hash, [key], {}]
+            return
+        node = self.root
+        while True:
+            distance = (node[0] ^ hash).bit_count()
+            if distance == 0:
+                node[1].append(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash, [key], {}]
+                return
+            node = child
+
+    def remove(self, hash: int, key) -> None:
+        # the node stays in place to route searches to its children, even
+        # once no item has its hash
+        node = self.root
+        while node is not None:
+            distance = (node[0] ^ hash).bit_count()
+            if distance == 0:
+                if key in node[1]:
+                    node[1].remove(key)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, hash: int, max_distance: int) -> list[tuple[int, object]]:
+        results = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = (node[0] ^ hash).bit_count()
+            if distance <= max_distance:
+                results.extend((distance, key) for key in node[1])
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda r: r[0])
+        return results
+
+
+class SimilarityIndex:
+    # In-memory BK-tree of the perceptual hashes of published items' images.
+    # Code that publishes or withdraws items or changes their images updates
+    # it through update() and discard(). It is also rebuilt every
+    # SIMILARITY_INDEX_TTL seconds, which picks up changes made by other
+    # processes, such as hashes backfilled from the CLI.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self._tree: BKTree | None = None
+        self._hashes: dict[int, int] = {}
+        self._built = 0.0
+        self.ttl = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        self.app = app
+        self.ttl = app.config['SIMILARITY_INDEX_TTL']
+        self._tree = None
+        self._hashes = {}
+        app.extensions['similarity_index'] = self
+
+    def tree(self) -> BKTree:
+        # callers hold the lock
+        if self._tree is None or time.monotonic() - self._built > self.ttl:
+            hashes = self.load()
+            self._tree = BKTree()
+            for id, hash in hashes.items():
+                self._tree.add(hash, id)
+            self._hashes = hashes
+            self._built = time.monotonic()
+        return self._tree
+
+    @staticmethod
+    def load(ids: Iterable[int] | None = None) -> dict[int, int]:
+        # hashes of published items, of all of them or only the given ones
+        import sqlalchemy as sa
+        from app import db
+        from app.main.image_files import to_unsigned
+        from app.models import FoundItem, FoundItemStatus, ImageBlob
+        query = sa.select(FoundItem.id, ImageBlob.phash) \
+            .join(ImageBlob, FoundItem.image_sha256 == ImageBlob.sha256) \
+            .where(FoundItem.status == FoundItemStatus.PUBLISHED,
+                   ImageBlob.phash.is_not(None))
+        if ids is not None:
+            query = query.where(FoundItem.id.in_(ids))
+        return {id: to_unsigned(phash) for id, phash in db.session.execute(query)}
+
+    def update(self, ids: list[int]) -> None:
+        """Reindex the given found items after their changes were committed."""
+        if self._tree is None:
+            return  # nothing to update until the first search builds it
+        hashes = self.load(ids)
+        with self._lock:
+            self._discard(ids)
+            if self._tree is None:
+                return
+            for id, hash in hashes.items():
+                self._hashes[id] = hash
+                self._tree.add(hash, id)
+
+    def discard(self, ids: list[int]) -> None:
+        """Remove found items that are no longer published."""
+        with self._lock:
+            self._discard(ids)
+
+    def _discard(self, ids: list[int]) -> None:
+        if self._tree is None:
+            return
+        for id in ids:
+            hash = self._hashes.pop(id, None)
+            if hash is not None:
+                self._tree.remove(hash, id)
+
+    def search(self, hash: int, max_distance: int, limit: int) -> list[tuple[int, int]]:
+        """Return (distance, found item id) pairs, closest first."""
+        with self._lock:
+            return self.tree().search(hash, max_distance)[:limit]
@@ -0,0 +1,215 @@
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from flask import Flask, Response, current_app, redirect, request, send_file
+
+# header the front-end server acts on for each STORAGE_OFFLOAD mode
+OFFLOAD_HEADERS = {'x-sendfile': 'X-Sendfile', 'x-accel-redirect': 'X-Accel-Redirect'}
+
+
+def storage_key(path: Path) -> str:
+    # files are known to every backend by their path under the static folder
+    assert current_app.static_folder is not None
+    return Path(path).resolve().relative_to(
+        Path(current_app.static_folder).resolve()).as_posix()
+
+
+def file_etag(path: Path) -> str:
+    st = path.stat()
+    return f'{st.st_mtime_ns:x}-{st.st_size:x}'
+
+
+class LocalBackend:
+    # Files are served from the static folder. With an offload mode set the
+    # response only carries headers and the front-end server sends the file,
+    # so a download does not hold a worker for its duration.
+    def __init__(self, offload: str, accel_prefix: str) -> None:
+        if offload and offload not in OFFLOAD_HEADERS:
+            raise ValueError(f'Unknown storage offload mode {offload!r}')
+        self.offload = offload
+        self.accel_prefix = accel_prefix
+
+    def store(self, path: Path) -> None:
+        pass
+
+    def store_tree(self, root: Path) -> None:
+        pass
+
+    def remove_tree(self, root: Path) -> None:
+        pass
+
+    def send(self, path: Path, etag: str | None = None, max_age: int | None = None,
+             immutable: bool = False, mimetype: str | None = None) -> Response:
+        if not self.offload:
+            response = send_file(path, mimetype=mimetype, etag=etag or True,
+                                 conditional=True, max_age=max_age)
+        else:
+            response = current_app.response_class(
+                mimetype=mimetype or mimetypes.guess_type(path.name)[0]
+                or 'application/octet-stream')
+            if self.offload == 'x-accel-redirect':
+                response.headers['X-Accel-Redirect'] = self.accel_prefix + storage_key(path)
+            else:
+                response.headers['X-Sendfile'] = str(path.resolve())
+            response.set_etag(etag or file_etag(path))
+            response.last_modified = int(path.stat().st_mtime)
+            if max_age is not None:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+            response.make_conditional(request)
+        if immutable:
+            response.cache_control.immutable = True
+        return response
+
+
+class S3Backend(LocalBackend):
+    # The static folder stays the working copy that thumbnails and variants
+    # are rendered from; the bucket mirrors it under the same keys. Published
+    # images are uploaded as they are published, anything else the first
+    # time it is requested, and clients are redirected to the object store.
+    KNOWN_KEYS = 10000
+
+    def __init__(self, config: dict) -> None:
+        super().__init__('', '')
+        try:
+            import boto3  # noqa: F401
+        except ImportError:
+            raise RuntimeError('The s3 storage backend requires boto3') from None
+        self.bucket = config['S3_BUCKET']
+        self.prefix = config['S3_PREFIX']
+        self.public_url = config['S3_PUBLIC_URL']
+        self.url_expires = config['S3_URL_EXPIRES']
+        self.client_options = {
+            'endpoint_url': config['S3_ENDPOINT_URL'],
+            'region_name': config['S3_REGION'],
+            'aws_access_key_id': config['S3_ACCESS_KEY_ID'],
+            'aws_secret_access_key': config['S3_SECRET_ACCESS_KEY'],
+        }
+        self._local = threading.local()
+        self._known: OrderedDict[str, None] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        # clients are not shared with forked worker processes
+        client = getattr(self._local, 'client', None)
+        if client is None or self._local.pid != os.getpid():
+            import boto3
+            client = boto3.client('s3', **self.client_options)
+            self._local.client = client
+            self._local.pid = os.getpid()
+        return client
+
+    def object_key(self, path: Path) -> str:
+        return self.prefix + storage_key(path)
+
+    def remember(self, key: str) -> None:
+        with self._lock:
+            self._known[key] = None
+            self._known.move_to_end(key)
+            while len(self._known) > self.KNOWN_KEYS:
+                self._known.popitem(last=False)
+
+    def store(self, path: Path) -> None:
+        key = self.object_key(path)
+        content_type = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+        self.client.upload_file(str(path), self.bucket, key,
+                                ExtraArgs={'ContentType': content_type})
+        self.remember(key)
+
+    def store_tree(self, root: Path) -> None:
+        for path in sorted(root.rglob('*')):
+            if path.is_file() and not path.name.startswith('.'):
+                self.store(path)
+
+    def remove_tree(self, root: Path) -> None:
+        prefix = self.object_key(root) + '/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys = [{'Key': entry['Key']} for entry in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': keys})
+        with self._lock:
+            for key in [key for key in self._known if key.startswith(prefix)]:
+                del self._known[key]
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        with self._lock:
+            if key in self._known:
+                return True
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError:
+            return False
+        self.remember(key)
+        return True
+
+    def send(self, path: Path, etag: str | None = None, max_age: int | None = None,
+             immutable: bool = False, mimetype: str | None = None) -> Response:
+        key = self.object_key(path)
+        if not self.exists(key):
+            self.store(path)
+        if self.public_url:
+            response = redirect(f'{self.public_url.rstrip("/")}/{key}')
+            if max_age is not None:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+            if immutable:
+                response.cache_control.immutable = True
+        else:
+            params = {'Bucket': self.bucket, 'Key': key}
+            if mimetype:
+                params['ResponseContentType'] = mimetype
+            response = redirect(self.client.generate_presigned_url(
+                'get_object', Params=params, ExpiresIn=self.url_expires))
+            # the signed URL must not outlive its signature in a cache
+            response.cache_control.private = True
+            response.cache_control.max_age = min(max_age or 0, self.url_expires // 2)
+        return response
+
+
+class Storage:
+    # Where image files are published and how they reach clients. Code that
+    # writes under the static folder tells the backend through store(),
+    # store_tree() and remove_tree(); views hand files to send().
+    def __init__(self, app: Flask | None = None) -> None:
+        self.backend: LocalBackend | None = None
+        self.local: LocalBackend | None = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        name = app.config['STORAGE_BACKEND']
+        self.local = LocalBackend(app.config['STORAGE_OFFLOAD'],
+                                  app.config['STORAGE_ACCEL_PREFIX'])
+        if name == 'local':
+            self.backend = self.local
+        elif name == 's3':
+            self.backend = S3Backend(app.config)
+        else:
+            raise ValueError(f'Unknown storage backend {name!r}')
+        app.extensions['storage'] = self
+
+    def store(self, path: Path) -> None:
+        assert self.backend is not None
+        self.backend.store(path)
+
+    def store_tree(self, root: Path) -> None:
+        assert self.backend is not None
+        self.backend.store_tree(root)
+
+    def remove_tree(self, root: Path) -> None:
+        assert self.backend is not None
+        self.backend.remove_tree(root)
+
+    def send(self, path: Path, **kwargs) -> Response:
+        assert self.backend is not None
+        return self.backend.send(path, **kwargs)
+
+    def send_static(self, path: Path, **kwargs) -> Response:
+        # application assets always come from the local static folder
+        assert self.local is not None
+        return self.local.send(path, **kwargs)
@@ -0,0 +1,229 @@
+import csv
+import json
+import os
+import tarfile
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Callable, Iterable, Iterator
+import sqlalchemy as sa
+from werkzeug.datastructures import FileStorage
+from app import db
+from app.models import FoundItem, FoundItemStatus, User
+from app.uploads import ImageRejected, ingest_image
+
+FIELDS = ('id', 'title', 'description', 'date_found', 'location_found', 'status',
+          'reporter', 'image')
+
+
+class TransferError(ValueError):
+    pass
+
+
+def image_name(found_item: FoundItem) -> str | None:
+    # name of the item's image inside the export tarball; content-addressed
+    # images are written once however many items share them
+    if not found_item.image_filename:
+        return None
+    ext = Path(found_item.image_filename).suffix
+    if found_item.image_sha256:
+        return f'images/{found_item.image_sha256}{ext}'
+    return f'images/item-{found_item.id}{ext}'
+
+
+def export_records(images: tarfile.TarFile | None = None) -> Iterator[dict]:
+    from app.main.image_files import image_path
+    written: set[str] = set()
+    query = sa.select(FoundItem, User.email) \
+        .join(User, FoundItem.user_id == User.id) \
+        .order_by(FoundItem.id) \
+        .execution_options(yield_per=500)
+    for found_item, email in db.session.execute(query):
+        name = image_name(found_item)
+        if name and images is not None and name not in written:
+            path = image_path(found_item)
+            if path.is_file():
+                images.add(path, arcname=name)
+                written.add(name)
+            else:
+                name = None
+        yield {
+            'id': found_item.id,
+            'title': found_item.title,
+            'description': found_item.description,
+            'date_found': found_item.date_found.isoformat() if found_item.date_found else None,
+            'location_found': found_item.location_found,
+            'status': found_item.status.value,
+            'reporter': email,
+            'image': name,
+        }
+        db.session.expunge(found_item)
+
+
+def write_records(records: Iterable[dict], out: IO[str], format: str) -> int:
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        for record in records:
+            writer.writerow(record)
+            count += 1
+    else:
+        for record in records:
+            out.write(json.dumps(record) + '\n')
+            count += 1
+    return count
+
+
+def read_records(source: IO[str], format: str) -> Iterator[dict]:
+    if format == 'csv':
+        for record in csv.DictReader(source):
+            yield {key: value or None for key, value in record.items()}
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)
+
+
+def parse_date(value: str | None, default: datetime) -> datetime:
+    # items without a date_found are dated by the import, as new reports are
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise TransferError(f'Invalid date_found {value!r}') from None
+
+
+class Checkpoint:
+    # Remembers how many records of a source have been committed, so an
+    # interrupted import picks up after the last committed batch.
+    def __init__(self, path: Path, source: str) -> None:
+        self.path = path
+        self.source = source
+        self.done = 0
+        try:
+            state = json.loads(path.read_text())
+            if state.get('source') == source:
+                self.done = int(state['done'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self, done: int) -> None:
+        self.done = done
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        tmp.write_text(json.dumps({'source': self.source, 'done': done}))
+        os.replace(tmp, self.path)
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
+
+
+class ItemImporter:
+    def __init__(self, images: tarfile.TarFile | None, default_reporter_id: int | None,
+                 batch_size: int) -> None:
+        self.images = images
+        self.default_reporter_id = default_reporter_id
+        self.batch_size = batch_size
+        self.skipped_images: list[str] = []
+        self._reporters: dict[str, int] = {}
+
+    def run(self, records: Iterator[dict], checkpoint: Checkpoint,
+            progress: Callable[[int], None] | None = None) -> int:
+        done = checkpoint.done
+        for _ in range(done):
+            if next(records, None) is None:
+                break
+        batch: list[dict] = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                done += self.import_batch(batch)
+                checkpoint.save(done)
+                batch = []
+                if progress:
+                    progress(done)
+        if batch:
+            done += self.import_batch(batch)
+            checkpoint.save(done)
+            if progress:
+                progress(done)
+        return done
+
+    def reporter_ids(self, records: list[dict]) -> list[int]:
+        emails = {r['reporter'] for r in records if r.get('reporter')} - set(self._reporters)
+        if emails:
+            self._reporters.update(db.session.execute(
+                sa.select(User.email, User.id).where(User.email.in_(emails))).all())
+        ids = []
+        for record in records:
+            id = self._reporters.get(record.get('reporter') or '')
+            if id is None:
+                if self.default_reporter_id is None:
+                    raise TransferError(f'Unknown reporter {record.get("reporter")!r}; '
+                                        'pass a default reporter')
+                id = self.default_reporter_id
+            ids.append(id)
+        return ids
+
+    def import_batch(self, records: list[dict]) -> int:
+        from app.main.image_files import upload_file, schedule_thumbnails
+        rows = []
+        imported = datetime.now(timezone.utc).replace(tzinfo=None)
+        for record, user_id in zip(records, self.reporter_ids(records)):
+            try:
+                status = FoundItemStatus(record.get('status') or 'review')
+            except ValueError:
+                raise TransferError(f'Unknown status {record.get("status")!r}')
+            rows.append({
+                'title': record.get('title') or '',
+                'description': record.get('description'),
+                'date_found': parse_date(record.get('date_found'), imported),
+                'location_found': record.get('location_found'),
+                'status': status,
+                'user_id': user_id,
+                'published': imported if status == FoundItemStatus.PUBLISHED else None,
+            })
+        # one multi-row INSERT per batch; RETURNING in parameter order maps
+        # the new ids back to their records
+        ids = db.session.scalars(
+            sa.insert(FoundItem).returning(FoundItem.id, sort_by_parameter_order=True),
+            rows).all()
+
+        with_images = {id: record['image'] for id, record in zip(ids, records)
+                       if record.get('image') and self.images is not None}
+        staged = []
+        if with_images:
+            found_items = db.session.scalars(
+                sa.select(FoundItem).where(FoundItem.id.in_(with_images)))
+            for found_item in found_items:
+                image = self.ingest(with_images[found_item.id])
+                if image is None:
+                    self.skipped_images.append(with_images[found_item.id])
+                else:
+                    staged_image = upload_file(image, found_item)
+                    if staged_image:
+                        staged.append((found_item.id, *staged_image))
+        db.session.commit()
+        db.session.expunge_all()
+        for args in staged:
+            schedule_thumbnails(*args)
+        return len(records)
+
+    def ingest(self, name: str):
+        assert self.images is not None
+        try:
+            member = self.images.getmember(name)
+        except KeyError:
+            return None
+        file = self.images.extractfile(member)
+        if file is None:
+            return None
+        try:
+            return ingest_image(FileStorage(stream=file, filename=name))
+        except ImageRejected:
+            return None
+
+
+def guess_format(path: str) -> str:
+    return 'csv' if path.endswith('.csv') else 'ndjson'
+
@@ -0,0 +1,139 @@
+import hashlib
+import tempfile
+from pathlib import Path
+from typing import IO, Any
+from flask import Request, current_app
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'JPEG'),
+    (b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (b'GIF87a', 'GIF'),
+    (b'GIF89a', 'GIF'),
+)
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+class HashingFile:
+    # File object handed to the multipart parser: uploaded bytes go straight
+    # to a temporary file next to the image store, hashed and counted as they
+    # are written, so nothing has to read the upload again afterwards.
+    def __init__(self, directory: Path, max_bytes: int) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile(
+            'w+b', dir=directory, prefix='.incoming-', delete=False)
+        self.path = Path(self._file.name)
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.header = b''
+
+    @property
+    def too_large(self) -> bool:
+        return self.size > self.max_bytes
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.too_large:
+            return len(data)
+        if len(self.header) < 32:
+            self.header += data[:32 - len(self.header)]
+        self.sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._file, name)
+
+    def discard(self) -> None:
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+class IngestedImage:
+    def __init__(self, path: Path, sha256: str, size: int, format: str,
+                 width: int, height: int) -> None:
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.format = format
+        self.width = width
+        self.height = height
+
+    @property
+    def ext(self) -> str:
+        return IMAGE_EXTENSIONS[self.format]
+
+
+def incoming_dir() -> Path:
+    assert current_app.static_folder is not None
+    return Path(current_app.static_folder, current_app.config['IMAGE_FOLDER'], '.incoming')
+
+
+def new_hashing_file() -> HashingFile:
+    return HashingFile(incoming_dir(), current_app.config['MAX_IMAGE_BYTES'])
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length: int | None,
+                         content_type: str | None, filename: str | None = None,
+                         content_length: int | None = None) -> IO[bytes]:
+        stream = new_hashing_file()
+        self.__dict__.setdefault('_hashing_files', []).append(stream)
+        return stream  # type: ignore
+
+    def close(self) -> None:
+        super().close()
+        # anything not moved into the image store by now was not wanted
+        for stream in self.__dict__.get('_hashing_files', []):
+            stream.discard()
+
+
+def sniff_format(header: bytes) -> str | None:
+    for signature, format in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return format
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def ingest_image(file: FileStorage) -> IngestedImage:
+    stream = file.stream
+    if not isinstance(stream, HashingFile):
+        # uploads that did not come through UploadRequest
+        copy = new_hashing_file()
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(64 * 1024), b''):
+            copy.write(chunk)
+        stream = copy
+    stream.flush()
+    stream.close()
+    try:
+        if stream.too_large:
+            raise ImageRejected('Image file is too large.')
+        format = sniff_format(stream.header)
+        if format is None:
+            raise ImageRejected('Invalid image file.')
+        try:
+            with Image.open(stream.path, formats=[format]) as img:
+                width, height = img.size
+                # checked from the header, before anything is decoded
+                if width * height > current_app.config['MAX_IMAGE_PIXELS']:
+                    raise ImageRejected('Image dimensions are too large.')
+                # truncated or corrupt files fail here, while the form can
+                # still say so, rather than later in the thumbnail worker
+                img.load()
+        except ImageRejected:
+            raise
+        except Exception:
+            raise ImageRejected('Invalid image file.')
+    except ImageRejected:
+        stream.discard()
+        raise
+    return IngestedImage(stream.path, stream.sha256.hexdigest(), stream.size,
+                         format, width, height)
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from flask import Flask
+
+AUTH_ATTRIBUTES = ('status', 'is_admin', 'password_hash')
+
+
+class UserCache:
+    # Per-process LRU cache of User column values used by the login user
+    # loader. Entries are served without a query for USER_CACHE_TTL seconds;
+    # after that a single auth_version lookup revalidates them. Commits that
+    # change a user's status, admin flag or password bump auth_version, drop
+    # the local entry and touch an epoch file that tells the other worker
+    # processes to drop theirs.
+    def __init__(self, app: Flask | None = None) -> None:
+        self.app: Flask | None = None
+        self.max_size = 0
+        self.ttl = 0
+        self.epoch_file = ''
+        self._epoch = 0
+        self._entries: OrderedDict[int, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        import sqlalchemy as sa
+        from app import db
+        self.app = app
+        self.max_size = app.config['USER_CACHE_SIZE']
+        self.ttl = app.config['USER_CACHE_TTL']
+        self.epoch_file = os.path.join(app.instance_path, 'user_cache.epoch')
+        self._epoch = self._read_epoch()
+        app.extensions['user_cache'] = self
+        if not sa.event.contains(db.session, 'before_flush', self._before_flush):
+            sa.event.listen(db.session, 'before_flush', self._before_flush)
+            sa.event.listen(db.session, 'after_commit', self._after_commit)
+            sa.event.listen(db.session, 'after_rollback', self._after_rollback)
+
+    def get(self, id: int):
+        from app import db
+        from app.models import User
+        if self.max_size <= 0:
+            return db.session.get(User, id)
+        self._check_epoch()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is not None:
+                self._entries.move_to_end(id)
+        values = None
+        if entry is not None:
+            expires, values = entry
+            if expires < now:
+                row = db.session.execute(
+                    db.select(User.auth_version, User.last_seen)
+                    .where(User.id == id)).first()
+                if row is None or row.auth_version != values['auth_version']:
+                    values = None
+                else:
+                    values = dict(values, last_seen=row.last_seen)
+                    self._store(id, values)
+        if values is None:
+            user = db.session.get(User, id)
+            if user is None:
+                self.discard(id)
+                return None
+            self._store(id, self._snapshot(user))
+            return user
+        return self._attach(values)
+
+    def discard(self, *ids: int) -> None:
+        with self._lock:
+            for id in ids:
+                self._entries.pop(id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _store(self, id: int, values: dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    @staticmethod
+    def _snapshot(user) -> dict[str, Any]:
+        import sqlalchemy.orm as so
+        return {attr.key: getattr(user, attr.key)
+                for attr in so.class_mapper(type(user)).column_attrs}
+
+    @staticmethod
+    def _attach(values: dict[str, Any]):
+        # every request gets its own instance, merged into its session
+        # without a query so it behaves exactly like a loaded one
+        import sqlalchemy.orm as so
+        from app import db
+        from app.models import User
+        user = User()
+        for key, value in values.items():
+            setattr(user, key, value)
+        so.make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def _read_epoch(self) -> int:
+        try:
+            return os.stat(self.epoch_file).st_mtime_ns
+        except OSError:
+            return 0
+
+    def _check_epoch(self) -> None:
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            self._epoch = epoch
+            self.clear()
+
+    def _bump_epoch(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.epoch_file), exist_ok=True)
+            with open(self.epoch_file, 'a'):
+                pass
+            os.utime(self.epoch_file)
+        except OSError:
+            if self.app is not None:
+                self.app.logger.exception('Could not update the user cache epoch')
+        self._epoch = self._read_epoch()
+
+    def _before_flush(self, session, flush_context, instances) -> None:
+        import sqlalchemy as sa
+        from app.models import User
+        changed = session.info.setdefault('user_cache_invalidate', set())
+        for obj in session.dirty:
+            if not isinstance(obj, User):
+                continue
+            state = sa.inspect(obj)
+            if any(state.attrs[key].history.has_changes() for key in AUTH_ATTRIBUTES):
+                obj.auth_version = (obj.auth_version or 0) + 1
+                changed.add(obj.id)
+        for obj in session.deleted:
+            if isinstance(obj, User):
+                changed.add(obj.id)
+
+    def _after_commit(self, session) -> None:
+        changed = session.info.pop('user_cache_invalidate', None)
+        if changed:
+            self.discard(*changed)
+            self._bump_epoch()
+
+    def _after_rollback(self, session) -> None:
+        session.info.pop('user_cache_invalidate', None)
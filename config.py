@@ -9,19 +9,105 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'this-is-a-test-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
+    # reads from @use_replica views go here when set; for SQLite a read-only
+    # connection such as sqlite:///file:app.db?mode=ro&uri=true also works
+    SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']} \
+        if os.environ.get('DATABASE_REPLICA_URL') else {}
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_PRE_PING = True
+    SQLITE_JOURNAL_MODE = 'WAL'
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+    SQLITE_BUSY_TIMEOUT = 5000
+    SQLITE_CACHE_SIZE = -16000
+    SQLITE_MMAP_SIZE = 128 * 1024 * 1024
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_FROMADDRESS = os.environ.get('MAIL_FROMADDRESS')
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_BATCH_SIZE = 20
+    MAIL_POLL_INTERVAL = 5
+    MAIL_CLAIM_TIMEOUT = 300
+    MAIL_RETRY_DELAY = 30
+    MAIL_MAX_ATTEMPTS = 6
+    MAIL_SENT_RETENTION_DAYS = int(os.environ.get('MAIL_SENT_RETENTION_DAYS') or 7)
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL') or 5)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # any value enables it; 'strict' fails requests that exceed their budget
+    QUERY_MONITOR = os.environ.get('QUERY_MONITOR') or ''
+    QUERY_REPEAT_THRESHOLD = 3
+    # 'memory' per process, 'sqlite' shared by the workers, '' disabled
+    FRAGMENT_CACHE_BACKEND = os.environ.get('FRAGMENT_CACHE_BACKEND', 'memory')
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 2048)
+    FRAGMENT_CACHE_FILE = 'fragments.sqlite'
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE') or 256)
+    PAGE_CACHE_TTL = int(os.environ.get('PAGE_CACHE_TTL') or 60)
+    PAGE_CACHE_STALE = int(os.environ.get('PAGE_CACHE_STALE') or 30)
+    API_ITEMS_PER_PAGE = 50
+    API_MAX_PER_PAGE = 200
+    API_CHANGES_SETTLE = 2
+    API_GZIP_MIN_SIZE = 512
     ADMINS = ['liam@lockwd.com']
     ITEMS_PER_PAGE = 3
+    SEARCH_RESULTS_PER_PAGE = 10
+    REVIEW_ITEMS_PER_PAGE = 50
+    SIMILAR_RESULTS = 12
+    SIMILAR_MAX_DISTANCE = 12
+    SIMILARITY_INDEX_TTL = 300
+    LOST_ITEM_MATCH_THRESHOLD = 0.5
+    LOST_ITEM_MATCH_LIMIT = 10
+    # relative to the instance folder
+    ARCHIVE_FOLDER = os.environ.get('ARCHIVE_FOLDER') or 'archive'
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 365)
     EMAIL_TOKEN_EXPIRATION = 600
+    LAST_SEEN_FRESHNESS = int(os.environ.get('LAST_SEEN_FRESHNESS') or 60)
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 30)
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 30)
     MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+    MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES') or 10 * 1024 * 1024)
+    MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS') or 40_000_000)
     IMAGE_FOLDER = 'images/'
     RESOURCES_FOLDER = 'resources/'
+    # output of `flask assets build`
+    ASSETS_FOLDER = 'assets/'
+    ASSET_CACHE_MAX_AGE = 365 * 24 * 60 * 60
     THUMBNAIL_MEDIA_ROOT = 'static/images/'
     THUMBNAIL_MEDIA_URL = 'images/'
+    THUMBNAIL_SIZES = {'small': (250, 250), 'large': (500, 500)}
+    THUMBNAIL_QUALITY = 75
+    THUMBNAIL_WIDTHS = (160, 250, 320, 500, 640, 1000)
+    THUMBNAIL_CACHE_FOLDER = 'thumbnail_cache/'
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES') or
+                                    256 * 1024 * 1024)
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS') or 2)
+    IMAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+    # 'local' serves images from the static folder, 's3' mirrors them to a
+    # bucket (needs boto3) and redirects clients there
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or 'local'
+    # 'x-sendfile' or 'x-accel-redirect' lets the front-end server send
+    # local files; STORAGE_ACCEL_PREFIX is the internal location mapped to
+    # the static folder
+    STORAGE_OFFLOAD = os.environ.get('STORAGE_OFFLOAD') or ''
+    STORAGE_ACCEL_PREFIX = os.environ.get('STORAGE_ACCEL_PREFIX') or '/protected/'
+    S3_BUCKET = os.environ.get('S3_BUCKET')
+    S3_PREFIX = os.environ.get('S3_PREFIX') or ''
+    S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+    S3_REGION = os.environ.get('S3_REGION')
+    S3_ACCESS_KEY_ID = os.environ.get('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.environ.get('S3_SECRET_ACCESS_KEY')
+    # objects are served from here when the bucket is public or behind a CDN,
+    # otherwise through presigned URLs
+    S3_PUBLIC_URL = os.environ.get('S3_PUBLIC_URL')
+    S3_URL_EXPIRES = int(os.environ.get('S3_URL_EXPIRES') or 3600)
+    IMAGE_VERSION_GRACE = int(os.environ.get('IMAGE_VERSION_GRACE') or 600)
+    # thumbnail jobs still unfinished after this long are considered lost
+    THUMBNAIL_JOB_TIMEOUT = int(os.environ.get('THUMBNAIL_JOB_TIMEOUT') or 900)
 
     SERVER_NAME = os.environ.get('SERVER_NAME') or 'localhost:5000'
@@ -0,0 +1,53 @@
+"""found item rejected status
+
+Revision ID: 8ef632592fbc
+Revises: cc07bcfc478c
+Create Date: 2026-10-18 06:50:00.104137
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8ef632592fbc'
+down_revision = 'cc07bcfc478c'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_TRIGGERS = [
+    "CREATE TRIGGER found_item_fts_ai AFTER INSERT ON found_item BEGIN "
+    "INSERT INTO found_item_fts(rowid, title, description, location_found) "
+    "VALUES (new.id, new.title, new.description, new.location_found); END",
+    "CREATE TRIGGER found_item_fts_ad AFTER DELETE ON found_item BEGIN "
+    "INSERT INTO found_item_fts(found_item_fts, rowid, title, description, location_found) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location_found); END",
+    "CREATE TRIGGER found_item_fts_au AFTER UPDATE OF title, description, location_found "
+    "ON found_item BEGIN "
+    "INSERT INTO found_item_fts(found_item_fts, rowid, title, description, location_found) "
+    "VALUES ('delete', old.id, old.title, old.description, old.location_found); "
+    "INSERT INTO found_item_fts(rowid, title, description, location_found) "
+    "VALUES (new.id, new.title, new.description, new.location_found); END",
+]
+
+
+def set_statuses(statuses):
+    with op.batch_alter_table('found_item', schema=None) as batch_op:
+        batch_op.drop_constraint('check_found_item_status', type_='check')
+        batch_op.create_check_constraint(
+            'check_found_item_status',
+            'status IN (' + ', '.join(f"'{status}'" for status in statuses) + ')')
+    if op.get_bind().dialect.name == 'sqlite':
+        # changing the constraint recreated found_item without its search triggers
+        for statement in SEARCH_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    set_statuses(['REVIEW', 'PUBLISHED', 'CLOSED', 'REJECTED'])
+
+
+def downgrade():
+    op.execute("UPDATE found_item SET status = 'CLOSED' WHERE status = 'REJECTED'")
+    set_statuses(['REVIEW', 'PUBLISHED', 'CLOSED'])
@@ -0,0 +1,59 @@
+"""found item search index
+
+Revision ID: 98f7cf8c2865
+Revises: 8974afd210a3
+Create Date: 2026-10-18 06:29:31.596888
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '98f7cf8c2865'
+down_revision = '8974afd210a3'
+branch_labels = None
+depends_on = None
+
+
+SEARCH_DOCUMENT = ("to_tsvector('english', coalesce(title, '') || ' ' || "
+                   "coalesce(description, '') || ' ' || coalesce(location_found, ''))")
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE found_item_fts USING fts5("
+            "title, description, location_found, "
+            "content='found_item', content_rowid='id', tokenize='porter unicode61')")
+        op.execute(
+            "CREATE TRIGGER found_item_fts_ai AFTER INSERT ON found_item BEGIN "
+            "INSERT INTO found_item_fts(rowid, title, description, location_found) "
+            "VALUES (new.id, new.title, new.description, new.location_found); END")
+        op.execute(
+            "CREATE TRIGGER found_item_fts_ad AFTER DELETE ON found_item BEGIN "
+            "INSERT INTO found_item_fts(found_item_fts, rowid, title, description, location_found) "
+            "VALUES ('delete', old.id, old.title, old.description, old.location_found); END")
+        op.execute(
+            "CREATE TRIGGER found_item_fts_au AFTER UPDATE OF title, description, location_found "
+            "ON found_item BEGIN "
+            "INSERT INTO found_item_fts(found_item_fts, rowid, title, description, location_found) "
+            "VALUES ('delete', old.id, old.title, old.description, old.location_found); "
+            "INSERT INTO found_item_fts(rowid, title, description, location_found) "
+            "VALUES (new.id, new.title, new.description, new.location_found); END")
+        op.execute("INSERT INTO found_item_fts(found_item_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        op.execute(f"CREATE INDEX ix_found_item_search ON found_item "
+                   f"USING gin (({SEARCH_DOCUMENT}))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS found_item_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS found_item_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS found_item_fts_ai")
+        op.execute("DROP TABLE IF EXISTS found_item_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_found_item_search")
@@ -0,0 +1,1052 @@
+import os
+os.environ['DATABASE_URL'] = 'sqlite://'
+
+import gzip
+import hashlib
+import io
+import json
+import random
+import shutil
+import socketserver
+import struct
+import tempfile
+import threading
+import unittest
+import zipfile
+import zlib
+from unittest import mock
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import sqlalchemy as sa
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from app import create_app, db, outbox, page_cache, user_cache
+from app.email import queue_email
+from app.main.image_files import blob_dir, collect_blobs
+from app.models import User, UserStatus, FoundItem, FoundItemStatus, ArchivedFoundItem, \
+    ImageBlob, LostItem, LostItemMatch, LostItemToken, OutboxMessage, OutboxStatus
+from app.query_monitor import QueryBudgetExceeded, query_budget
+from app.similarity import BKTree
+from app.matching import score_reports
+from app.pagination import paginate_found_items, decode_cursor
+from app.transfer import Checkpoint, ItemImporter, TransferError, read_records
+from app.uploads import ImageRejected, incoming_dir, ingest_image
+from config import Config
+
+
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    THUMBNAIL_WORKERS = 0
+    # tests deliver mail themselves
+    MAIL_WORKERS = 0
+
+
+class AppTestCase(unittest.TestCase):
+    # Requests run in their own app context, as they do when served, so
+    # tests only push one around direct database work.
+    config = TestConfig
+
+    def setUp(self):
+        self.app = create_app(self.config)
+        # the caches are shared by every app the tests create
+        page_cache.clear()
+        user_cache.clear()
+        self.static_folder = tempfile.mkdtemp()
+        self.app.static_folder = self.static_folder
+        # keep the epoch files and the archive out of the real instance
+        # folder; the caches resolved their paths in init_app
+        self.instance_path = tempfile.mkdtemp()
+        self.app.instance_path = self.instance_path
+        page_cache.epoch_file = os.path.join(self.instance_path, 'page_cache.epoch')
+        user_cache.epoch_file = os.path.join(self.instance_path, 'user_cache.epoch')
+        user_cache._epoch = 0
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            user = User(email='admin@example.com', name='Admin',
+                        status=UserStatus.ACTIVE, is_admin=True)
+            user.set_password('secret')
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.id
+
+    def tearDown(self):
+        with self.app.app_context():
+            db.drop_all()
+        shutil.rmtree(self.static_folder)
+        shutil.rmtree(self.instance_path)
+
+    def login(self):
+        return self.client.post('/auth/login', data={'email': 'admin@example.com',
+                                                     'password': 'secret'})
+
+    def post_found_item(self, url='/found_item', color=(255, 0, 0), **fields):
+        image = io.BytesIO()
+        Image.new('RGB', (320, 240), color).save(image, format='PNG')
+        image.seek(0)
+        data = {'title': 'Umbrella', 'description': 'Red', 'date_found': '2026-01-01',
+                'location_found': 'Gym', 'image_file': (image, 'umbrella.png'), **fields}
+        return self.client.post(url, data=data, content_type='multipart/form-data')
+
+    def add_found_items(self, *items):
+        # items are (title, date_found, status) tuples; returns their ids
+        found_items = [FoundItem(title=title, status=status, user_id=self.user_id)
+                       for title, _, status in items]
+        db.session.add_all(found_items)
+        db.session.flush()
+        # set after the insert, which would fill in a missing date_found
+        for found_item, (_, date_found, _) in zip(found_items, items):
+            found_item.date_found = date_found
+        db.session.commit()
+        return [found_item.id for found_item in found_items]
+
+
+class PaginationCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    def walk(self, per_page):
+        pages, cursor = [], None
+        while True:
+            page = paginate_found_items(cursor, per_page)
+            pages.append(page)
+            if not page.has_next:
+                return pages
+            self.assertLess(len(pages), 20, 'pagination does not terminate')
+            cursor = page.next_cursor
+
+    def test_cursor_round_trip(self):
+        self.add_found_items(('a', datetime(2026, 1, 1), FoundItemStatus.PUBLISHED),
+                             ('b', datetime(2026, 1, 2), FoundItemStatus.REVIEW))
+        page = paginate_found_items(None, 1)
+        self.assertEqual(decode_cursor(page.next_cursor),
+                         ('next', (datetime(2026, 1, 2), page.items[0].id)))
+        self.assertEqual(decode_cursor('tampered'), ('next', None))
+
+    def test_undated_items_come_last(self):
+        ids = self.add_found_items(
+            ('a', datetime(2026, 1, 3), FoundItemStatus.PUBLISHED),
+            ('b', None, FoundItemStatus.REVIEW),
+            ('c', datetime(2026, 1, 1), FoundItemStatus.CLOSED),
+            ('d', None, FoundItemStatus.PUBLISHED),
+            ('e', datetime(2026, 1, 3), FoundItemStatus.REVIEW),
+            ('f', None, FoundItemStatus.CLOSED),
+            ('g', datetime(2026, 1, 2), FoundItemStatus.PUBLISHED))
+        a, b, c, d, e, f, g = ids
+        expected = [e, a, g, c, f, d, b]
+        for per_page in (1, 2, 3, 7):
+            pages = self.walk(per_page)
+            self.assertEqual([i.id for page in pages for i in page], expected)
+
+            # and back again from the last page
+            seen, page = [], pages[-1]
+            while page.has_prev:
+                page = paginate_found_items(page.prev_cursor, per_page)
+                seen = [i.id for i in page] + seen
+            self.assertEqual(seen + [i.id for i in pages[-1]], expected)
+
+    def test_cursor_of_undated_item(self):
+        ids = self.add_found_items(('a', None, FoundItemStatus.PUBLISHED),
+                                   ('b', None, FoundItemStatus.PUBLISHED))
+        page = paginate_found_items(None, 1)
+        self.assertEqual([i.id for i in page], [ids[1]])
+        self.assertEqual(decode_cursor(page.next_cursor), ('next', (None, ids[1])))
+        page = paginate_found_items(page.next_cursor, 1)
+        self.assertEqual([i.id for i in page], [ids[0]])
+        self.assertFalse(page.has_next)
+
+
+class QueryBudgetCase(AppTestCase):
+    # budgets raise QueryBudgetExceeded under TESTING, so a view that goes
+    # over fails its request
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            statuses = (FoundItemStatus.PUBLISHED, FoundItemStatus.REVIEW,
+                        FoundItemStatus.CLOSED)
+            self.ids = self.add_found_items(*(
+                (f'item {n}', datetime(2026, 1, n % 28 + 1) if n % 5 else None,
+                 statuses[n % 3]) for n in range(40)))
+            db.session.add(ArchivedFoundItem(id=1000, title='Old', user_id=self.user_id,
+                                             status=FoundItemStatus.CLOSED))
+            db.session.commit()
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertIn('X-Query-Count', response.headers)
+        return response
+
+    def test_index(self):
+        cursor = self.get('/api/v1/found_items?per_page=10').json['next_cursor']
+        self.get('/index')
+        self.get(f'/index?cursor={cursor}')
+        self.login()
+        self.get('/index')
+
+    def test_found_item(self):
+        self.get(f'/found_item/{self.ids[0]}')
+        self.get('/found_item/1000')
+        self.login()
+        self.assertEqual(self.post_found_item().status_code, 302)
+        self.get(f'/found_item/{self.ids[-1] + 1}')
+        self.assertEqual(self.post_found_item(f'/found_item/{self.ids[0]}/update',
+                                              color=(0, 0, 255)).status_code, 302)
+
+    def test_api(self):
+        page = self.get('/api/v1/found_items').json
+        self.get(f'/api/v1/found_items?cursor={page["next_cursor"]}')
+        self.get('/api/v1/found_items/batch?ids=' + ','.join(map(str, self.ids)))
+        self.get(f'/api/v1/found_items/{self.ids[0]}')
+        self.get('/api/v1/changes')
+
+    def test_review_queue(self):
+        self.login()
+        self.get('/review')
+        response = self.client.post('/review', data={'ids': self.ids[1:12:3],
+                                                     'publish': 'Publish'})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(f'/found_item/{self.ids[13]}/publish')
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post('/review', data={'ids': self.ids[:12],
+                                                     'close': 'Close'})
+        self.assertEqual(response.status_code, 302)
+
+    def test_budget_is_enforced(self):
+        @query_budget(1)
+        def over_budget():
+            db.session.get(User, self.user_id)
+            db.session.scalars(sa.select(FoundItem)).all()
+            return ''
+        self.app.add_url_rule('/over-budget', view_func=over_budget)
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get('/over-budget')
+
+
+class ModerationCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.review_id, self.published_id = self.add_found_items(
+            ('Umbrella', None, FoundItemStatus.REVIEW),
+            ('Scarf', None, FoundItemStatus.PUBLISHED))
+        self.login()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    def moderate(self, action):
+        self.client.post('/review', data={'ids': [self.review_id, self.published_id],
+                                          action: action.capitalize()})
+        db.session.expire_all()
+        return (db.session.get(FoundItem, self.review_id).status,
+                db.session.get(FoundItem, self.published_id).status)
+
+    def test_queue_lists_published_items(self):
+        response = self.client.get('/review')
+        self.assertIn(b'Umbrella', response.data)
+        self.assertIn(b'Scarf', response.data)
+
+    def test_reject_leaves_published_items(self):
+        self.assertEqual(self.moderate('reject'),
+                         (FoundItemStatus.REJECTED, FoundItemStatus.PUBLISHED))
+
+    def test_close_published_items(self):
+        with mock.patch('app.main.routes.similarity_index') as index:
+            self.assertEqual(self.moderate('close'),
+                             (FoundItemStatus.CLOSED, FoundItemStatus.CLOSED))
+        index.discard.assert_called_once()
+        self.assertCountEqual(index.discard.call_args.args[0],
+                              [self.review_id, self.published_id])
+
+
+class MatchingCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.login()
+        # token weights: red and umbrella 3/8 each, gym 2/8
+        self.report('Red umbrella', 'Gym')
+        self.report('Water bottle', 'Library')
+        self.umbrella_id, self.bottle_id = db.session.scalars(
+            sa.select(LostItem.id).order_by(LostItem.id)).all()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    def report(self, title, location):
+        response = self.client.post('/lost_item', data={'title': title,
+                                                        'location_lost': location})
+        self.assertEqual(response.status_code, 302)
+
+    def publish(self, title):
+        id, = self.add_found_items((title, None, FoundItemStatus.REVIEW))
+        self.assertEqual(self.client.post(f'/found_item/{id}/publish').status_code, 302)
+        return id
+
+    def mail(self):
+        return db.session.scalars(sa.select(OutboxMessage.recipients)).all()
+
+    def test_publish_scores_only_reports_sharing_tokens(self):
+        with mock.patch('app.matching.score_reports', wraps=score_reports) as score:
+            self.publish('Red umbrella')
+        postings, tokens = score.call_args.args
+        self.assertEqual(tokens, {'red', 'umbrella'})
+        # only the postings of the item's own tokens were read
+        self.assertEqual(set(postings), {'red', 'umbrella'})
+        self.assertEqual({id for posting in postings.values() for id, _ in posting},
+                         {self.umbrella_id})
+
+    def test_threshold_queues_outbox_mail(self):
+        # red alone scores 3/8, below LOST_ITEM_MATCH_THRESHOLD
+        self.publish('Red scarf')
+        self.assertEqual(self.mail(), [])
+        found_item_id = self.publish('Red umbrella')
+        self.assertEqual(self.mail(), [['admin@example.com']])
+        match = db.session.scalar(sa.select(LostItemMatch))
+        self.assertEqual((match.lost_item_id, match.found_item_id),
+                         (self.umbrella_id, found_item_id))
+        self.assertAlmostEqual(match.score, 0.75)
+
+    def test_closed_reports_leave_the_index(self):
+        self.client.post(f'/lost_item/{self.umbrella_id}/close')
+        self.assertEqual(set(db.session.scalars(
+            sa.select(LostItemToken.lost_item_id))), {self.bottle_id})
+        self.publish('Red umbrella')
+        self.assertEqual(self.mail(), [])
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    # just enough SMTP for smtplib; recipients containing 'bounce' are refused
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 stub')
+        recipients = []
+        while line := self.rfile.readline():
+            command = line.decode().rstrip('\r\n')
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.reply('250 stub')
+            elif verb == 'RCPT':
+                if 'bounce' in command:
+                    self.reply('550 no such user')
+                else:
+                    recipients.append(command)
+                    self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline().rstrip(b'\r\n') != b'.':
+                    pass
+                self.server.messages.append(recipients)
+                recipients = []
+                self.reply('250 ok')
+            elif verb == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class OutboxCase(AppTestCase):
+    def setUp(self):
+        self.smtp = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+        self.smtp.daemon_threads = True
+        self.smtp.connections = 0
+        self.smtp.messages = []
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.config = type('OutboxConfig', (TestConfig,), {
+            'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': self.smtp.server_address[1],
+            'MAIL_SUPPRESS_SEND': False, 'MAIL_MAX_ATTEMPTS': 3})
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+        self.smtp.shutdown()
+        self.smtp.server_close()
+
+    def queue(self, *recipients):
+        for recipient in recipients:
+            queue_email('Found', 'lostandfound@example.com', [recipient], 'text', None)
+        db.session.commit()
+
+    def message(self, recipient):
+        return db.session.scalar(sa.select(OutboxMessage).where(
+            OutboxMessage.recipients == [recipient]))
+
+    def make_due(self):
+        db.session.execute(sa.update(OutboxMessage).values(
+            next_attempt=datetime.now(timezone.utc).replace(tzinfo=None)))
+        db.session.commit()
+
+    def test_purge_keeps_recent_and_undelivered_messages(self):
+        self.queue('old@example.com', 'new@example.com', 'pending@example.com')
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        for recipient, sent in (('old@example.com', now - timedelta(days=8)),
+                                ('new@example.com', now - timedelta(days=6))):
+            message = self.message(recipient)
+            message.status = OutboxStatus.SENT
+            message.sent = sent
+        db.session.commit()
+        self.assertEqual(outbox.purge(), 1)
+        self.assertIsNone(self.message('old@example.com'))
+        self.assertIsNotNone(self.message('new@example.com'))
+        self.assertIsNotNone(self.message('pending@example.com'))
+
+    def test_gauge_is_registered_once(self):
+        create_app(self.config)
+        response = self.client.get('/metrics')
+        self.assertEqual(response.data.count(b'\nmail_outbox_pending '), 1)
+
+    def test_batch_is_sent_over_one_connection(self):
+        self.queue('a@example.com', 'b@example.com', 'c@example.com')
+        self.assertEqual(outbox.deliver(), 3)
+        self.assertEqual(self.smtp.connections, 1)
+        self.assertEqual(len(self.smtp.messages), 3)
+        self.assertEqual(outbox.stats()['sent'], 3)
+        self.assertEqual(outbox.deliver(), 0)
+
+    def test_failures_back_off_exponentially(self):
+        delay = self.app.config['MAIL_RETRY_DELAY']
+        self.queue('a@example.com', 'bounce@example.com')
+        start = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.assertEqual(outbox.deliver(), 2)
+        self.assertEqual(self.message('a@example.com').status, OutboxStatus.SENT)
+        message = self.message('bounce@example.com')
+        self.assertEqual((message.status, message.attempts), (OutboxStatus.PENDING, 1))
+        self.assertIn('no such user', message.last_error)
+        self.assertGreaterEqual(message.next_attempt, start + timedelta(seconds=delay))
+        # not due again until the delay has passed
+        self.assertEqual(outbox.deliver(), 0)
+
+        self.make_due()
+        start = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.assertEqual(outbox.deliver(), 1)
+        db.session.expire_all()
+        message = self.message('bounce@example.com')
+        self.assertEqual(message.attempts, 2)
+        self.assertGreaterEqual(message.next_attempt, start + timedelta(seconds=2 * delay))
+
+        # MAIL_MAX_ATTEMPTS is 3
+        self.make_due()
+        outbox.deliver()
+        db.session.expire_all()
+        message = self.message('bounce@example.com')
+        self.assertEqual((message.status, message.attempts), (OutboxStatus.FAILED, 3))
+        self.make_due()
+        self.assertEqual(outbox.deliver(), 0)
+
+    def test_connection_failure_retries_every_message(self):
+        self.queue('a@example.com', 'b@example.com')
+        self.smtp.shutdown()
+        self.smtp.server_close()
+        self.assertEqual(outbox.deliver(), 2)
+        for recipient in ('a@example.com', 'b@example.com'):
+            message = self.message(recipient)
+            self.assertEqual((message.status, message.attempts), (OutboxStatus.PENDING, 1))
+            self.assertIsNone(message.claim)
+
+
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = None
+
+
+class FakeS3:
+    # in-memory stand-in for the calls S3Backend makes on a boto3 client
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as f:
+            self.objects[bucket, key] = (f.read(), ExtraArgs['ContentType'])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f'https://s3.example.com/{Params["Bucket"]}/{Params["Key"]}?expires={ExpiresIn}'
+
+    def get_paginator(self, operation):
+        objects = self.objects
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key} for bucket, key in objects
+                                    if bucket == Bucket and key.startswith(Prefix)]}
+        return Paginator()
+
+    def delete_objects(self, Bucket, Delete):
+        for entry in Delete['Objects']:
+            self.objects.pop((Bucket, entry['Key']), None)
+
+
+class S3Config(TestConfig):
+    STORAGE_BACKEND = 's3'
+    S3_BUCKET = 'lostandfound'
+    S3_PREFIX = 'media/'
+    IMAGE_VERSION_GRACE = 0
+
+
+@unittest.skipIf(boto3 is None, 'the s3 storage backend requires boto3')
+class S3StorageCase(AppTestCase):
+    config = S3Config
+
+    def setUp(self):
+        self.s3 = FakeS3()
+        patcher = mock.patch('boto3.client', return_value=self.s3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        super().setUp()
+        self.login()
+        self.assertEqual(self.post_found_item().status_code, 302)
+        with self.app.app_context():
+            self.sha256 = db.session.get(FoundItem, 1).image_sha256
+        self.key = f'media/images/blobs/{self.sha256[:2]}/{self.sha256}/image.png'
+
+    def test_published_images_are_uploaded(self):
+        self.assertEqual(self.s3.objects['lostandfound', self.key][1], 'image/png')
+        thumbnail = self.key.replace('image.png', 'thumb_small/thumb.jpg')
+        self.assertIn(('lostandfound', thumbnail), self.s3.objects)
+
+    def test_images_redirect_to_presigned_urls(self):
+        response = self.client.get(f'/images/1?v={self.sha256[:16]}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['Location'],
+                         f'https://s3.example.com/lostandfound/{self.key}?expires=3600')
+        # a cached redirect must not outlive the signature
+        self.assertTrue(response.cache_control.private)
+        self.assertLessEqual(response.cache_control.max_age, 1800)
+
+    def test_missing_objects_are_uploaded_on_request(self):
+        del self.s3.objects['lostandfound', self.key]
+        self.app.extensions['storage'].backend._known.clear()
+        self.assertEqual(self.client.get('/images/1').status_code, 302)
+        self.assertIn(('lostandfound', self.key), self.s3.objects)
+
+    def test_public_url(self):
+        self.app.extensions['storage'].backend.public_url = 'https://cdn.example.com/'
+        response = self.client.get(f'/images/1?v={self.sha256[:16]}')
+        self.assertEqual(response.headers['Location'], f'https://cdn.example.com/{self.key}')
+        self.assertTrue(response.cache_control.immutable)
+
+    def test_unused_images_are_removed(self):
+        self.assertEqual(self.post_found_item('/found_item/1/update',
+                                              color=(0, 0, 255)).status_code, 302)
+        with self.app.app_context():
+            self.assertEqual(collect_blobs(), 1)
+        self.assertFalse([key for _, key in self.s3.objects if self.sha256 in key])
+        self.assertTrue(self.s3.objects)
+
+
+class BlobStoreConfig(TestConfig):
+    IMAGE_VERSION_GRACE = 0
+
+
+class BlobStoreCase(AppTestCase):
+    # blobs are keyed by the SHA-256 of the uploaded bytes, so the same file
+    # uploaded twice is stored once
+    config = BlobStoreConfig
+
+    def setUp(self):
+        super().setUp()
+        self.login()
+        for _ in range(2):
+            self.assertEqual(self.post_found_item(color=(255, 0, 0)).status_code, 302)
+        with self.app.app_context():
+            self.red = db.session.get(FoundItem, 1).image_sha256
+
+    def refs(self):
+        with self.app.app_context():
+            return dict(db.session.execute(
+                sa.select(ImageBlob.sha256, ImageBlob.ref_count)).tuples().all())
+
+    def item_image(self, id):
+        with self.app.app_context():
+            return db.session.get(FoundItem, id).image_sha256
+
+    def test_identical_uploads_share_a_blob(self):
+        self.assertEqual(self.item_image(2), self.red)
+        self.assertEqual(self.refs(), {self.red: 2})
+        with self.app.app_context():
+            self.assertTrue(blob_dir(self.red).is_dir())
+            self.assertEqual(len(list(blob_dir(self.red).parent.parent.glob('*/*'))), 1)
+
+    def test_ref_count_follows_edits(self):
+        self.post_found_item('/found_item/2/update', color=(0, 0, 255))
+        blue = self.item_image(2)
+        self.assertEqual(self.refs(), {self.red: 1, blue: 1})
+        self.post_found_item('/found_item/1/update', color=(0, 0, 255))
+        self.assertEqual(self.refs(), {self.red: 0, blue: 2})
+        # saving the form with the same image again takes no new reference
+        self.post_found_item('/found_item/1/update', color=(0, 0, 255))
+        self.assertEqual(self.refs(), {self.red: 0, blue: 2})
+
+    def test_gc_removes_unused_blobs(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(args=['images', 'gc'])
+        self.assertIn('Removed 0 unused images.', result.output)
+        self.post_found_item('/found_item/1/update', color=(0, 0, 255))
+        self.post_found_item('/found_item/2/update', color=(0, 0, 255))
+        blue = self.item_image(1)
+        result = runner.invoke(args=['images', 'gc'])
+        self.assertIn('Removed 1 unused images.', result.output)
+        self.assertEqual(self.refs(), {blue: 2})
+        with self.app.app_context():
+            self.assertFalse(blob_dir(self.red).exists())
+            self.assertTrue(blob_dir(blue).is_dir())
+
+
+class ArchiveCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login()
+        for n, color in enumerate(((255, 0, 0), (0, 255, 0), (0, 0, 255))):
+            self.assertEqual(self.post_found_item(title=f'Item {n + 1}',
+                                                  color=color).status_code, 302)
+        self.client.post('/review', data={'ids': [1, 2, 3], 'close': 'Close'})
+        with self.app.app_context():
+            # closed long ago, except item 2
+            db.session.execute(sa.update(FoundItem).values(updated=sa.case(
+                (FoundItem.id == 2, datetime.now(timezone.utc).replace(tzinfo=None)),
+                else_=datetime(2026, 1, 2))))
+            db.session.commit()
+            self.images = {id: Path(self.static_folder, 'images', 'blobs', sha256[:2],
+                                    sha256, 'image.png').read_bytes()
+                           for id, sha256 in db.session.execute(
+                               sa.select(FoundItem.id, FoundItem.image_sha256))}
+
+    def archive(self):
+        return self.app.test_cli_runner().invoke(args=['items', 'archive', '--days', '30'])
+
+    def test_closed_items_move_into_month_zip(self):
+        self.assertIn('Archived 1 found items.', self.archive().output)
+        with self.app.app_context():
+            self.assertEqual(db.session.scalars(sa.select(ArchivedFoundItem.id)).all(), [1])
+            # item 2 was closed recently and item 3 is the newest
+            self.assertEqual(db.session.scalars(
+                sa.select(FoundItem.id).order_by(FoundItem.id)).all(), [2, 3])
+            sha256 = db.session.get(ArchivedFoundItem, 1).image_filename
+        with zipfile.ZipFile(Path(self.instance_path, 'archive', '2026-01.zip')) as archive:
+            self.assertEqual(archive.namelist(), [sha256])
+            self.assertEqual(archive.read(sha256), self.images[1])
+
+    def test_archived_items_are_served(self):
+        self.archive()
+        self.client.get('/auth/logout')
+        response = self.client.get('/found_item/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Item 1', response.data)
+        response = self.client.get('/images/1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, self.images[1])
+        response = self.client.get('/images/1/thumb_large')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(response.data)).format, 'JPEG')
+
+    def test_newest_item_is_never_archived(self):
+        with self.app.app_context():
+            db.session.execute(sa.update(FoundItem).values(updated=datetime(2026, 1, 2)))
+            db.session.commit()
+        self.assertIn('Archived 2 found items.', self.archive().output)
+        with self.app.app_context():
+            self.assertEqual(db.session.scalars(sa.select(FoundItem.id)).all(), [3])
+
+
+class UserCacheCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    def cached(self):
+        # a fresh session each time, as each request gets
+        db.session.remove()
+        return user_cache.get(self.user_id)
+
+    def update_elsewhere(self, **values):
+        # a commit made by another process, which this one's session
+        # events never see
+        db.session.execute(sa.update(User).where(User.id == self.user_id).values(values))
+        db.session.commit()
+
+    def test_auth_changes_invalidate(self):
+        changes = (('status', UserStatus.INACTIVE), ('is_admin', False),
+                   ('password_hash', 'changed'))
+        for version, (attribute, value) in enumerate(changes, 1):
+            self.cached()
+            user = db.session.get(User, self.user_id)
+            setattr(user, attribute, value)
+            db.session.commit()
+            user = self.cached()
+            self.assertEqual(getattr(user, attribute), value)
+            self.assertEqual(user.auth_version, version)
+
+    def test_other_changes_keep_entry(self):
+        self.cached()
+        user = db.session.get(User, self.user_id)
+        user.name = 'Renamed'
+        db.session.commit()
+        self.update_elsewhere(is_admin=False)
+        # still served from the cache, which nothing invalidated
+        self.assertTrue(self.cached().is_admin)
+
+    def test_epoch_drops_entries_of_other_processes(self):
+        self.cached()
+        self.update_elsewhere(is_admin=False, auth_version=User.auth_version + 1)
+        self.assertTrue(self.cached().is_admin)
+        # the other process touches the epoch file after committing
+        Path(user_cache.epoch_file).touch()
+        os.utime(user_cache.epoch_file, ns=(1, 1))
+        self.assertFalse(self.cached().is_admin)
+
+    def test_revalidation_after_ttl(self):
+        user_cache.ttl = 0
+        self.cached()
+        self.update_elsewhere(is_admin=False)
+        # only auth_version is checked, so the entry stays
+        self.assertTrue(self.cached().is_admin)
+        self.update_elsewhere(auth_version=User.auth_version + 1)
+        self.assertFalse(self.cached().is_admin)
+
+
+class ApiConfig(TestConfig):
+    API_CHANGES_SETTLE = 0
+
+
+class ApiCase(AppTestCase):
+    config = ApiConfig
+
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            self.ids = self.add_found_items(
+                ('Umbrella', datetime(2026, 1, 3), FoundItemStatus.PUBLISHED),
+                ('Scarf', datetime(2026, 1, 2), FoundItemStatus.PUBLISHED),
+                ('Gloves', datetime(2026, 1, 1), FoundItemStatus.PUBLISHED),
+                ('Wallet', datetime(2026, 1, 4), FoundItemStatus.REVIEW))
+            db.session.execute(sa.update(FoundItem)
+                               .where(FoundItem.status == FoundItemStatus.PUBLISHED)
+                               .values(published=FoundItem.updated))
+            db.session.commit()
+
+    def test_etag_and_not_modified(self):
+        url = f'/api/v1/found_items/{self.ids[0]}'
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        with self.app.app_context():
+            db.session.get(FoundItem, self.ids[0]).title = 'Black umbrella'
+            db.session.commit()
+        response = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_gzip_negotiation(self):
+        plain = self.client.get('/api/v1/found_items')
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.app.config['API_GZIP_MIN_SIZE'] = 0
+        compressed = self.client.get('/api/v1/found_items',
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', compressed.headers['Vary'])
+        self.assertEqual(gzip.decompress(compressed.data), plain.data)
+        # one document, one ETag, whatever the encoding
+        self.assertEqual(compressed.headers['ETag'], plain.headers['ETag'])
+        self.assertNotIn('Content-Encoding',
+                         self.client.get('/api/v1/found_items').headers)
+
+    def test_list_cursors(self):
+        page = self.client.get('/api/v1/found_items?per_page=2&fields=title').json
+        self.assertEqual([item['title'] for item in page['items']], ['Umbrella', 'Scarf'])
+        self.assertEqual(set(page['items'][0]), {'id', 'title'})
+        page = self.client.get(
+            f'/api/v1/found_items?per_page=2&cursor={page["next_cursor"]}').json
+        self.assertEqual([item['title'] for item in page['items']], ['Gloves'])
+        self.assertIsNone(page['next_cursor'])
+        page = self.client.get(
+            f'/api/v1/found_items?per_page=2&cursor={page["prev_cursor"]}').json
+        self.assertEqual([item['title'] for item in page['items']], ['Umbrella', 'Scarf'])
+        # a cursor that was not issued here starts from the top
+        page = self.client.get('/api/v1/found_items?per_page=2&cursor=forged').json
+        self.assertEqual([item['title'] for item in page['items']], ['Umbrella', 'Scarf'])
+
+    def test_batch(self):
+        umbrella, scarf, _, wallet = self.ids
+        response = self.client.get(
+            f'/api/v1/found_items/batch?ids={scarf},999,{umbrella},{wallet},{scarf}')
+        self.assertEqual([item['id'] for item in response.json['items']], [scarf, umbrella])
+        # items that are not published look the same as missing ones
+        self.assertEqual(response.json['missing'], [999, wallet])
+        response = self.client.get('/api/v1/found_items/batch?ids=1,x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['error'], 'Bad Request')
+        self.app.config['API_MAX_PER_PAGE'] = 2
+        self.assertEqual(
+            self.client.get('/api/v1/found_items/batch?ids=1,2,3').status_code, 400)
+
+    def test_changes_feed(self):
+        umbrella, scarf, gloves, wallet = self.ids
+        page = self.client.get('/api/v1/changes?limit=2').json
+        self.assertEqual([item['id'] for item in page['items']], [umbrella, scarf])
+        self.assertTrue(page['has_more'])
+        page = self.client.get(f'/api/v1/changes?limit=2&since={page["since"]}').json
+        self.assertEqual([item['id'] for item in page['items']], [gloves])
+        self.assertFalse(page['has_more'])
+        since = page['since']
+        # nothing new: the same token comes back
+        page = self.client.get(f'/api/v1/changes?since={since}').json
+        self.assertEqual((page['items'], page['removed'], page['since']), ([], [], since))
+
+        self.login()
+        self.client.post('/review', data={'ids': [umbrella, wallet], 'close': 'Close'})
+        page = self.client.get(f'/api/v1/changes?since={since}').json
+        # the never-published wallet stays out of the feed
+        self.assertEqual((page['items'], page['removed']), ([], [umbrella]))
+        self.assertEqual(self.client.get('/api/v1/changes?since=forged').status_code, 400)
+
+
+class PageCacheCase(AppTestCase):
+    # anonymous pages are cached until a commit changes a found item; a hit
+    # runs no statements and so carries no X-Query-Count
+    def setUp(self):
+        super().setUp()
+        with self.app.app_context():
+            self.ids = self.add_found_items(
+                ('Umbrella', datetime(2026, 1, 1), FoundItemStatus.REVIEW),
+                ('Scarf', datetime(2026, 1, 2), FoundItemStatus.REVIEW))
+        self.anonymous = self.app.test_client()
+        self.login()
+
+    def cached(self, url):
+        response = self.anonymous.get(url)
+        self.assertEqual(response.status_code, 200)
+        return 'X-Query-Count' not in response.headers
+
+    def test_publish_invalidates(self):
+        urls = ['/index', f'/found_item/{self.ids[0]}']
+        for url in urls:
+            self.assertFalse(self.cached(url))
+            self.assertTrue(self.cached(url))
+        self.client.post(f'/found_item/{self.ids[0]}/publish')
+        for url in urls:
+            self.assertFalse(self.cached(url))
+            self.assertTrue(self.cached(url))
+
+    def test_review_queue_invalidates(self):
+        self.assertFalse(self.cached('/index'))
+        self.client.post('/review', data={'ids': self.ids, 'publish': 'Publish'})
+        self.assertFalse(self.cached('/index'))
+
+    def test_update_invalidates(self):
+        self.assertFalse(self.cached('/index'))
+        self.post_found_item(f'/found_item/{self.ids[1]}/update', title='Blue scarf')
+        self.assertFalse(self.cached('/index'))
+        self.assertIn(b'Blue scarf', self.anonymous.get('/index').data)
+
+    def test_unrelated_commits_keep_pages(self):
+        self.assertFalse(self.cached('/index'))
+        response = self.client.post('/lost_item', data={'title': 'Keys',
+                                                        'description': 'Blue ring'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.cached('/index'))
+
+    def test_signed_in_pages_are_private(self):
+        response = self.client.get('/index')
+        self.assertTrue(response.cache_control.private)
+        self.assertIn('X-Query-Count', response.headers)
+
+
+class UploadCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    @staticmethod
+    def png(size=(320, 240)):
+        image = io.BytesIO()
+        Image.new('RGB', size, (0, 128, 255)).save(image, format='PNG')
+        return image.getvalue()
+
+    @staticmethod
+    def with_dimensions(png, width, height):
+        # rewrites the IHDR chunk, so the header claims a size the pixel
+        # data does not have
+        header = png[12:16] + struct.pack('>II', width, height) + png[24:29]
+        return png[:12] + header + struct.pack('>I', zlib.crc32(header)) + png[33:]
+
+    def ingest(self, data, filename='image.png'):
+        return ingest_image(FileStorage(stream=io.BytesIO(data), filename=filename))
+
+    def assertRejected(self, data, message):
+        with self.assertRaisesRegex(ImageRejected, message):
+            self.ingest(data)
+        # the upload is not left behind
+        self.assertEqual(list(incoming_dir().iterdir()), [])
+
+    def test_hash_and_size_are_recorded(self):
+        data = self.png()
+        image = self.ingest(data)
+        self.assertEqual(image.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(image.size, len(data))
+        self.assertEqual((image.format, image.width, image.height), ('PNG', 320, 240))
+        self.assertEqual(image.path.read_bytes(), data)
+
+    def test_oversize_file_is_rejected(self):
+        data = self.png()
+        self.app.config['MAX_IMAGE_BYTES'] = len(data) - 1
+        self.assertRejected(data, 'too large')
+
+    def test_pixel_limit(self):
+        self.app.config['MAX_IMAGE_PIXELS'] = 320 * 240 - 1
+        self.assertRejected(self.png(), 'dimensions are too large')
+
+    def test_decompression_bomb_is_not_decoded(self):
+        bomb = self.with_dimensions(self.png(), 8000, 8000)
+        with mock.patch.object(Image.Image, 'load') as load:
+            self.assertRejected(bomb, 'dimensions are too large')
+        load.assert_not_called()
+        # far past Pillow's own limit the header is refused outright
+        self.assertRejected(self.with_dimensions(self.png(), 50000, 50000),
+                            'Invalid image file')
+
+    def test_non_image_is_rejected(self):
+        self.assertRejected(b'%PDF-1.7 not an image', 'Invalid image file')
+        self.assertRejected(b'\x89PNG\r\n\x1a\n' + b'\0' * 64, 'Invalid image file')
+
+    def test_truncated_image_is_rejected(self):
+        data = self.png()
+        self.assertRejected(data[:len(data) // 2], 'Invalid image file')
+
+    def test_form_reports_corrupt_image(self):
+        self.login()
+        data = self.png()
+        response = self.client.post('/found_item', data={
+            'title': 'Umbrella', 'description': 'Red', 'date_found': '2026-01-01',
+            'location_found': 'Gym',
+            'image_file': (io.BytesIO(data[:len(data) // 2]), 'umbrella.png'),
+        }, content_type='multipart/form-data')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Invalid image file.', response.data)
+        self.assertEqual(db.session.scalar(sa.select(sa.func.count(FoundItem.id))), 0)
+
+
+class ImportCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.checkpoint_path = Path(self.static_folder, 'import.checkpoint')
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        super().tearDown()
+
+    def records(self, *titles, **fields):
+        lines = [json.dumps({'title': title, 'reporter': 'admin@example.com', **fields})
+                 for title in titles]
+        return iter(read_records(io.StringIO('\n'.join(lines)), 'ndjson'))
+
+    def titles(self):
+        return db.session.scalars(sa.select(FoundItem.title).order_by(FoundItem.id)).all()
+
+    def test_resume_from_checkpoint(self):
+        checkpoint = Checkpoint(self.checkpoint_path, 'items.ndjson')
+        importer = ItemImporter(None, None, batch_size=2)
+        records = self.records('a', 'b', 'c', 'd', 'e')
+
+        # the third batch fails after two were committed
+        def fail(batch):
+            raise TransferError('interrupted')
+        batches = [importer.import_batch, importer.import_batch, fail]
+        importer.import_batch = lambda batch: batches.pop(0)(batch)
+        with self.assertRaises(TransferError):
+            importer.run(records, checkpoint)
+        db.session.rollback()
+        self.assertEqual(self.titles(), ['a', 'b', 'c', 'd'])
+
+        checkpoint = Checkpoint(self.checkpoint_path, 'items.ndjson')
+        self.assertEqual(checkpoint.done, 4)
+        done = ItemImporter(None, None, batch_size=2).run(
+            self.records('a', 'b', 'c', 'd', 'e'), checkpoint)
+        self.assertEqual(done, 5)
+        self.assertEqual(self.titles(), ['a', 'b', 'c', 'd', 'e'])
+
+        # a checkpoint of another source is not resumed from
+        self.assertEqual(Checkpoint(self.checkpoint_path, 'other.ndjson').done, 0)
+
+    def test_missing_date_found_defaults_to_import_time(self):
+        before = datetime.now(timezone.utc).replace(tzinfo=None)
+        ItemImporter(None, None, batch_size=10).import_batch(
+            list(self.records('a')) + list(self.records('b', date_found='2026-01-02')))
+        db.session.commit()
+        dates = dict(db.session.execute(
+            sa.select(FoundItem.title, FoundItem.date_found)).tuples().all())
+        self.assertGreaterEqual(dates['a'], before)
+        self.assertEqual(dates['b'], datetime(2026, 1, 2))
+
+    def test_invalid_date_found(self):
+        with self.assertRaisesRegex(TransferError, "Invalid date_found 'yesterday'"):
+            ItemImporter(None, None, batch_size=10).import_batch(
+                list(self.records('a', date_found='yesterday')))
+
+
+class BKTreeCase(unittest.TestCase):
+    def test_search_after_remove(self):
+        rnd = random.Random(1)
+        hashes = [rnd.getrandbits(64) for _ in range(2000)]
+        tree = BKTree()
+        for key, hash in enumerate(hashes):
+            tree.add(hash, key)
+        for key, hash in enumerate(hashes):
+            if key % 3 == 0:
+                tree.remove(hash, key)
+        self.assertEqual(tree.size, len([k for k in range(len(hashes)) if k % 3]))
+        query = hashes[10] ^ 0b1011
+        expected = sorted(((hash ^ query).bit_count(), key) for key, hash in enumerate(hashes)
+                          if key % 3 and (hash ^ query).bit_count() <= 12)
+        self.assertEqual(sorted(tree.search(query, 12)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)